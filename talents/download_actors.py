@@ -1,91 +1,2277 @@
 import os
+import argparse
+import asyncio
+import email.utils
+import hashlib
+import json
+import math
+import shutil
+import socket
+import sqlite3
+import tempfile
+import threading
 import requests
 import time
-from PIL import Image
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, ThreadPoolExecutor, as_completed, wait
+from contextlib import asynccontextmanager, contextmanager, nullcontext
+from datetime import datetime, timezone
+from requests.adapters import HTTPAdapter
+from urllib.parse import urlparse
+from PIL import ExifTags, Image, ImageChops, ImageCms, ImageOps, ImageStat
 from io import BytesIO
+from image_formats import EXTENSIONS, MIME_TYPES, check_format, sniff_format
 import random
+from collections import deque
+
+try:
+    import aiohttp
+except ImportError:  # the asyncio pipeline is optional
+    aiohttp = None
+
+# User agents to avoid being blocked
+USER_AGENTS = [
+    'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36',
+    'Mozilla/5.0 (Macintosh; Intel Mac OS X 10_15_7) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36',
+    'Mozilla/5.0 (Windows NT 10.0; Win64; x64; rv:89.0) Gecko/20100101 Firefox/89.0'
+]
+
+# For demonstration, instead of actually using real image APIs (which would require keys),
+# we use placeholder image URLs that are guaranteed to work, one per attempt
+PLACEHOLDER_URLS = [
+    "https://picsum.photos/800/1200",
+    "https://source.unsplash.com/random/800x1200/?portrait",
+    "https://baconmockup.com/800/1200"
+]
+
+REQUEST_TIMEOUT = 10
+
+# Hosts whose connection pools the session keeps; sources redirect to CDN hosts
+# beyond the configured ones, and evicted pools would redo their handshakes
+POOLED_HOSTS = 32
+
+# Streaming mode writes response bodies to disk in chunks of this size
+STREAM_CHUNK_SIZE = 64 * 1024
+DEFAULT_MAX_BYTES = 25 * 1024 * 1024
+
+# JPEG draft decoding keeps at least this multiple of the target size
+JPEG_DRAFT_GAP = 2
+
+# Image metadata that survives stripping: transparency is part of the pixels,
+# and the ICC profile follows the --icc policy
+KEPT_METADATA = ('transparency', 'icc_profile')
+ICC_POLICIES = ('keep', 'strip', 'srgb')
+
+# Responsive size variants are stored under actors_images/variants/<width>/
+VARIANTS_DIR = "variants"
+DEFAULT_VARIANT_WIDTHS = [64, 128, 256, 512, 1024]
+
+# Modern formats saved next to the PNGs: (setting, lossless, save options) candidates per format.
+# Lossy candidates are encoded at the quality setting and must reach the PSNR target.
+MODERN_ENCODINGS = {
+    'WEBP': [("lossy", False, {'method': 4}), ("lossless", True, {'lossless': True, 'quality': 100, 'method': 4})],
+    'AVIF': [("lossy", False, {})],
+}
+DEFAULT_QUALITY = 80
+DEFAULT_MIN_PSNR = 38.0
+
+# Files are written to hidden "<.name>.<pid>-<random>.tmp" files and renamed into place;
+# leftovers older than STALE_TEMP_AGE seconds are swept at startup
+TEMP_SUFFIX = ".tmp"
+STALE_TEMP_AGE = 600
+FSYNC_POLICIES = ('always', 'batch', 'never')
+FSYNC_BATCH_SIZE = 32
+
+# Actors whose last run failed transiently are retried after an exponential delay
+# (per consecutive failure); the journal is compacted once it holds this many stale lines
+JOURNAL_RETRY_BASE_DELAY = 300.0
+JOURNAL_RETRY_MAX_DELAY = 24 * 3600.0
+JOURNAL_COMPACT_MIN_LINES = 1000
+
+# A source that failed for an actor is not asked for that actor again for
+# this long, doubling per consecutive failure up to the maximum
+NEGATIVE_TTL = 3600.0
+NEGATIVE_MAX_TTL = 7 * 24 * 3600.0
+
+# Local working state (partial downloads, caches) lives outside actors_images
+DEFAULT_STATE_DIR = ".download_state"
+
+# Each shard of a sharded run works in its own directory below this one
+SHARDS_DIR = "shards"
+
+# Actors processed when no roster file is given
+ACTORS = [
+    "Johnny Depp", "Jennifer Lawrence", "Bradley Cooper", "Charlize Theron",
+    "Ryan Reynolds", "Anne Hathaway", "Benedict Cumberbatch", "Emma Stone",
+    "Matt Damon", "Chris Pratt", "Cate Blanchett", "Julia Roberts",
+    "Jake Gyllenhaal", "Gal Gadot", "Dwayne Johnson", "Zac Efron",
+    "Ryan Gosling", "Rooney Mara", "Keira Knightley", "John Cena",
+    "Susan Sarandon", "Michael B. Jordan", "Salma Hayek", "Zoe Saldana",
+    "Sandra Oh", "Channing Tatum", "John Boyega", "Tracee Ellis Ross"
+]
+
+# How many times an interrupted transfer is resumed from the same source
+RESUME_ATTEMPTS = 2
+
+# Per-host request rate; replaces the old fixed sleeps between actors and attempts
+DEFAULT_RATE = 5.0
+DEFAULT_BURST = 5
+# How long a host is paused after a 429 that carries no Retry-After header
+DEFAULT_THROTTLE_PAUSE = 5.0
+
+# Hedged requests: start the next source when the current one has not
+# answered within the hedge delay (the host's observed p90 latency by default)
+DEFAULT_HEDGE_DELAY = 1.0
+HEDGE_PERCENTILE = 0.9
+HEDGE_MIN_SAMPLES = 10
+
+# Adaptive (AIMD) concurrency: grow by one slot per window of healthy requests,
+# halve on timeouts, 429s and 5xx responses
+DEFAULT_MAX_PER_HOST = 16
+DEFAULT_TARGET_LATENCY = 2.0
+ADAPTIVE_WINDOW = 50
+ADAPTIVE_MIN_SAMPLES = 10
+ADAPTIVE_MAX_ERROR_RATE = 0.05
+ADAPTIVE_BACKOFF = 0.5
+
+# Circuit breaker: open a source after this many consecutive failures and
+# send a single probe request once the cooldown has passed
+DEFAULT_BREAKER_THRESHOLD = 5
+DEFAULT_BREAKER_COOLDOWN = 30.0
+# Smoothing factor for the per-source success rate and latency averages
+HEALTH_EWMA_ALPHA = 0.2
+
+# Retries of the same source: exponential backoff with full jitter, and a
+# run-wide budget so retries stay a small fraction of all requests
+DEFAULT_MAX_RETRIES = 1
+DEFAULT_RETRY_BASE_DELAY = 0.5
+DEFAULT_RETRY_MAX_DELAY = 10.0
+DEFAULT_RETRY_BUDGET = 0.2
+RETRY_BUDGET_MINIMUM = 10
+
+class ImageTooLarge(Exception):
+    """Raised when a response body exceeds the configured maximum size."""
+
+class IncompleteDownload(Exception):
+    """Raised when a transfer ends before the full body was received."""
+
+class DownloadCancelled(Exception):
+    """Raised inside a hedged request once another source has already won."""
+
+class SourceUnavailable(Exception):
+    """Raised instead of sending a request to a source whose circuit is open."""
 
 def clean_name_for_file(name):
     """Convert actor name to lowercase with hyphens for filenames."""
     return name.lower().replace(' ', '-')
 
-def create_cdn_link(actor_name):
-    """Create the CDN link in the required format."""
+def check_cancelled(cancel):
+    if cancel is not None and cancel.is_set():
+        raise DownloadCancelled()
+
+def percentile(values, fraction):
+    """Return the value at the given fraction (0-1) of the sorted values."""
+    if not values:
+        return None
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(fraction * len(ordered)))]
+
+def error_status(error):
+    """HTTP status carried by a requests or aiohttp error, or None."""
+    response = getattr(error, 'response', None)
+    return getattr(response, 'status_code', None) or getattr(error, 'status', None)
+
+def is_congestion_error(error):
+    """True for failures that mean the host is overloaded: timeouts, 429 and 5xx."""
+    if isinstance(error, (requests.Timeout, requests.ConnectionError, TimeoutError)):
+        return True
+    if aiohttp and isinstance(error, aiohttp.ClientConnectionError):
+        return True
+    status = error_status(error)
+    return status == 429 or (status is not None and status >= 500)
+
+def is_source_failure(error):
+    """
+    True when an error says something about the source itself. Client errors
+    such as 404 only concern the requested image, so the host still counts
+    as healthy.
+    """
+    status = error_status(error)
+    return not (status is not None and 400 <= status < 500 and status not in (408, 429))
+
+class ConcurrencyLimit:
+    """
+    Limit on in-flight requests to one host. A fixed limit behaves like a
+    semaphore; an adaptive limit grows additively while the p95 latency and
+    error rate of recent requests are healthy and shrinks multiplicatively
+    on congestion errors.
+    """
+
+    def __init__(self, limit, max_limit=None, adaptive=False, target_latency=DEFAULT_TARGET_LATENCY):
+        self.limit = float(limit)
+        self.max_limit = max_limit or limit
+        self.adaptive = adaptive
+        self.target_latency = target_latency
+        self.in_flight = 0
+        self.samples = deque(maxlen=ADAPTIVE_WINDOW)
+        self.last_decrease = 0.0
+        self._condition = threading.Condition()
+
+    def acquire(self):
+        with self._condition:
+            while self.in_flight >= int(self.limit):
+                self._condition.wait()
+            self.in_flight += 1
+
+    def release(self, latency=None, congested=False):
+        with self._condition:
+            saturated = self.in_flight >= int(self.limit)
+            self.in_flight -= 1
+            if self.adaptive and latency is not None:
+                self._adjust(latency, congested, saturated)
+            self._condition.notify_all()
+
+    def _adjust(self, latency, congested, saturated):
+        self.samples.append((latency, congested))
+        now = time.monotonic()
+        if congested:
+            # Back off at most once per target latency so a burst of
+            # concurrent failures counts as a single congestion signal
+            if now - self.last_decrease >= self.target_latency:
+                self.limit = max(1.0, self.limit * ADAPTIVE_BACKOFF)
+                self.last_decrease = now
+            return
+        if not saturated or len(self.samples) < ADAPTIVE_MIN_SAMPLES:
+            return
+        p95 = percentile([sample[0] for sample in self.samples], 0.95)
+        error_rate = sum(1 for sample in self.samples if sample[1]) / len(self.samples)
+        if p95 <= self.target_latency and error_rate <= ADAPTIVE_MAX_ERROR_RATE:
+            self.limit = min(self.max_limit, self.limit + 1.0 / self.limit)
+
+class CircuitBreaker:
+    """
+    Closed/open/half-open breaker with an exponentially weighted health score
+    for one source host.
+    """
+
+    def __init__(self, threshold=DEFAULT_BREAKER_THRESHOLD, cooldown=DEFAULT_BREAKER_COOLDOWN):
+        self.threshold = threshold
+        self.cooldown = cooldown
+        self.state = 'closed'
+        self.failures = 0
+        self.opened_at = 0.0
+        self.probing = False
+        self.success_rate = 1.0
+        self.latency = 0.0
+
+    def allow(self):
+        """Whether a request may go to this source now."""
+        if self.state == 'closed':
+            return True
+        if self.state == 'open' and time.monotonic() - self.opened_at >= self.cooldown:
+            self.state = 'half-open'
+        if self.state == 'half-open' and not self.probing:
+            self.probing = True
+            return True
+        return False
+
+    def record(self, ok, latency):
+        self.success_rate += HEALTH_EWMA_ALPHA * ((1.0 if ok else 0.0) - self.success_rate)
+        self.latency += HEALTH_EWMA_ALPHA * (latency - self.latency)
+        self.probing = False
+        if ok:
+            self.state = 'closed'
+            self.failures = 0
+            return
+        self.failures += 1
+        if self.state == 'half-open' or self.failures >= self.threshold:
+            self.state = 'open'
+            self.opened_at = time.monotonic()
+
+    def abandon(self):
+        """Forget an allowed request that was cancelled before it finished."""
+        self.probing = False
+
+    @property
+    def score(self):
+        """Higher is healthier: recent success rate discounted by recent latency."""
+        return self.success_rate / (1.0 + self.latency)
+
+class SourceHealth:
+    """Circuit breakers and health scores for every source host."""
+
+    def __init__(self, threshold=DEFAULT_BREAKER_THRESHOLD, cooldown=DEFAULT_BREAKER_COOLDOWN):
+        self.threshold = threshold
+        self.cooldown = cooldown
+        self._breakers = {}
+        self._lock = threading.Lock()
+
+    def _breaker(self, url):
+        host = urlparse(url).netloc
+        if host not in self._breakers:
+            self._breakers[host] = CircuitBreaker(self.threshold, self.cooldown)
+        return self._breakers[host]
+
+    def allow(self, url):
+        with self._lock:
+            return self._breaker(url).allow()
+
+    def record(self, url, error, latency):
+        """Record the outcome of a request; error is None on success."""
+        with self._lock:
+            breaker = self._breaker(url)
+            was_open = breaker.state != 'closed'
+            breaker.record(error is None or not is_source_failure(error), latency)
+            if breaker.state == 'open' and not was_open:
+                print(f"Circuit opened for {urlparse(url).netloc} after {breaker.failures} failures")
+            elif breaker.state == 'closed' and was_open:
+                print(f"Circuit closed for {urlparse(url).netloc}")
+
+    def abandon(self, url):
+        with self._lock:
+            self._breaker(url).abandon()
+
+    def order(self, urls):
+        """Attempt numbers (1-based) for urls, healthiest source first."""
+        with self._lock:
+            scores = [self._breaker(url).score for url in urls]
+        return sorted(range(1, len(urls) + 1), key=lambda attempt: -scores[attempt - 1])
+
+    def report(self):
+        with self._lock:
+            for host, breaker in sorted(self._breakers.items()):
+                print(f"  {host}: circuit {breaker.state}, health {breaker.score:.2f} "
+                      f"(success {breaker.success_rate:.0%}, latency {breaker.latency:.2f}s)")
+
+def is_dns_failure(error):
+    """True if the error (or anything it wraps) is a failed host name lookup."""
+    seen = set()
+    pending = [error]
+    while pending:
+        current = pending.pop()
+        if current is None or id(current) in seen:
+            continue
+        seen.add(id(current))
+        if isinstance(current, socket.gaierror) or type(current).__name__ == 'NameResolutionError':
+            return True
+        pending.extend([current.__cause__, current.__context__, getattr(current, 'reason', None)])
+        pending.extend(arg for arg in getattr(current, 'args', ()) if isinstance(arg, BaseException))
+    return False
+
+class RetryPolicy:
+    """
+    Decides whether a failed request is retried against the same source.
+    Timeouts, dropped connections, 429 and 5xx are retryable; client errors,
+    DNS failures, oversized or undecodable images and open circuits are fatal
+    for that source, so the actor moves straight on to the next one.
+    """
+
+    def __init__(self, max_retries=DEFAULT_MAX_RETRIES, base_delay=DEFAULT_RETRY_BASE_DELAY,
+                 max_delay=DEFAULT_RETRY_MAX_DELAY, budget_ratio=DEFAULT_RETRY_BUDGET):
+        self.max_retries = max_retries
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.budget_ratio = budget_ratio
+        self.requests = 0
+        self.retries = 0
+        self.denied = 0
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def is_retryable(error):
+        if isinstance(error, (ImageTooLarge, SourceUnavailable, DownloadCancelled)):
+            return False
+        if is_dns_failure(error):
+            return False
+        if isinstance(error, (IncompleteDownload, requests.exceptions.ChunkedEncodingError)):
+            return True
+        return is_congestion_error(error)
+
+    def budget(self):
+        return RETRY_BUDGET_MINIMUM + int(self.budget_ratio * self.requests)
+
+    def record_request(self):
+        with self._lock:
+            self.requests += 1
+
+    def should_retry(self, error, retries):
+        """Whether to retry after `retries` retries of this source already failed."""
+        if retries >= self.max_retries or not self.is_retryable(error):
+            return False
+        with self._lock:
+            if self.retries >= self.budget():
+                if not self.denied:
+                    print("Retry budget exhausted, failing over without retrying")
+                self.denied += 1
+                return False
+            self.retries += 1
+            return True
+
+    def backoff(self, retries):
+        """Full-jitter exponential backoff for the given retry number."""
+        return random.uniform(0, min(self.max_delay, self.base_delay * (2 ** retries)))
+
+    def report(self):
+        print(f"Retries: {self.retries} of {self.requests} requests "
+              f"(budget {self.budget()}, {self.denied} denied)")
+
+class HostLimiter:
+    """
+    Caps the number of in-flight requests per source host so that running
+    many workers does not hammer a single image provider. With adaptive=True
+    each host starts at per_host and moves between 1 and max_per_host.
+    """
+
+    def __init__(self, per_host=4, adaptive=False, max_per_host=DEFAULT_MAX_PER_HOST,
+                 target_latency=DEFAULT_TARGET_LATENCY):
+        self.per_host = per_host
+        self.adaptive = adaptive
+        self.max_per_host = max(max_per_host, per_host) if adaptive else per_host
+        self.target_latency = target_latency
+        self._limits = {}
+        self._lock = threading.Lock()
+
+    def acquire(self, url):
+        """Wait for a request slot on the host of the given URL and return its limit."""
+        host = urlparse(url).netloc
+        with self._lock:
+            if host not in self._limits:
+                self._limits[host] = ConcurrencyLimit(self.per_host, self.max_per_host,
+                                                      self.adaptive, self.target_latency)
+            limit = self._limits[host]
+        limit.acquire()
+        return limit
+
+    def current_limits(self):
+        """Current in-flight limit for every host seen so far."""
+        with self._lock:
+            return {host: int(limit.limit) for host, limit in self._limits.items()}
+
+class RunStats:
+    """Per-host request counts and latencies collected over a run."""
+
+    def __init__(self):
+        self.hosts = {}
+        self.stripped_images = 0
+        self.stripped_bytes = 0
+        self._lock = threading.Lock()
+
+    def record_stripped(self, removed):
+        """Count the metadata bytes that stripping kept out of one saved image."""
+        if not removed:
+            return
+        with self._lock:
+            self.stripped_images += 1
+            self.stripped_bytes += removed
+
+    def latency_percentile(self, url, fraction, min_samples=1):
+        """Observed latency percentile for the host of url, or None with too few samples."""
+        with self._lock:
+            entry = self.hosts.get(urlparse(url).netloc)
+            if not entry or len(entry['latencies']) < min_samples:
+                return None
+            return percentile(entry['latencies'], fraction)
+
+    def record(self, url, latency, error=None):
+        host = urlparse(url).netloc
+        with self._lock:
+            entry = self.hosts.setdefault(host, {
+                'requests': 0, 'errors': 0, 'congestion': 0, 'latencies': deque(maxlen=1000),
+            })
+            entry['requests'] += 1
+            entry['latencies'].append(latency)
+            if error is not None:
+                entry['errors'] += 1
+                if is_congestion_error(error):
+                    entry['congestion'] += 1
+
+    def report(self, limits=None):
+        """Print one line of statistics per host."""
+        limits = limits or {}
+        with self._lock:
+            for host, entry in sorted(self.hosts.items()):
+                p50 = percentile(entry['latencies'], 0.5) or 0.0
+                p95 = percentile(entry['latencies'], 0.95) or 0.0
+                line = (f"  {host}: {entry['requests']} requests, {entry['errors']} errors "
+                        f"({entry['congestion']} congestion), p50 {p50:.2f}s, p95 {p95:.2f}s")
+                if host in limits:
+                    line += f", concurrency limit {limits[host]}"
+                print(line)
+
+class TokenBucket:
+    """
+    Token bucket allowing `rate` requests per second with bursts of up to
+    `burst` requests. Callers reserve a token and are told how long to wait,
+    so the same bucket can be shared by threads and by the event loop.
+    """
+
+    def __init__(self, rate, burst):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = float(burst)
+        self.updated = time.monotonic()
+        self.paused_until = 0.0
+        self._lock = threading.Lock()
+
+    def reserve(self):
+        """Take a token and return the number of seconds to wait before using it."""
+        with self._lock:
+            now = time.monotonic()
+            self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+            # Tokens may go negative; the debt is paid by waiting
+            self.tokens -= 1
+            wait = -self.tokens / self.rate if self.tokens < 0 else 0.0
+            return max(wait, self.paused_until - now)
+
+    def pause(self, seconds):
+        """Stop handing out tokens for the given number of seconds."""
+        with self._lock:
+            now = time.monotonic()
+            self.paused_until = max(self.paused_until, now + seconds)
+            # Do not let a burst build up while paused
+            self.tokens = min(self.tokens, 0.0)
+            self.updated = max(self.updated, self.paused_until)
+
+class RateLimiter:
+    """One token bucket per source host, shared by every worker."""
+
+    def __init__(self, rate=DEFAULT_RATE, burst=DEFAULT_BURST):
+        self.rate = rate
+        self.burst = burst
+        self._buckets = {}
+        self._lock = threading.Lock()
+
+    def bucket(self, url):
+        host = urlparse(url).netloc
+        with self._lock:
+            if host not in self._buckets:
+                self._buckets[host] = TokenBucket(self.rate, self.burst)
+            return self._buckets[host]
+
+    def reserve(self, url):
+        return self.bucket(url).reserve()
+
+    def pause(self, url, seconds):
+        self.bucket(url).pause(seconds)
+
+def parse_retry_after(value):
+    """Parse a Retry-After header (delta seconds or HTTP date) into seconds."""
+    if not value:
+        return None
+    value = value.strip()
+    if value.isdigit():
+        return float(value)
+    try:
+        when = email.utils.parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return None
+    if when.tzinfo is None:
+        when = when.replace(tzinfo=timezone.utc)
+    return max(0.0, (when - datetime.now(timezone.utc)).total_seconds())
+
+def temp_path_for(path):
+    """A unique hidden temporary file next to path; sweep_temp_files() recognises these."""
+    directory, name = os.path.split(path)
+    return os.path.join(directory, f".{name}.{os.getpid()}-{random.getrandbits(32):08x}{TEMP_SUFFIX}")
+
+def fsync_path(path):
+    """Flush a file, or a directory entry list, to disk."""
+    fd = os.open(path, os.O_RDONLY)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+@contextmanager
+def atomic_write(path, fsync=False, fsync_dir=None):
+    """
+    Yield a temporary path next to path for the caller to write, then rename
+    it into place, so path only ever holds a complete file. With fsync=True
+    the file is flushed to disk before the rename, and its directory after
+    it unless fsync_dir says otherwise. The temporary file is removed if
+    writing fails.
+    """
+    tmp_path = temp_path_for(path)
+    try:
+        yield tmp_path
+        if fsync:
+            fsync_path(tmp_path)
+        os.replace(tmp_path, path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+    if fsync if fsync_dir is None else fsync_dir:
+        fsync_path(os.path.dirname(path) or '.')
+
+def sweep_temp_files(root, max_age=STALE_TEMP_AGE):
+    """
+    Remove temporary files under root left behind by killed runs. Files
+    younger than max_age seconds may belong to a run still in progress and
+    are kept. Returns the number of files removed.
+    """
+    removed = 0
+    cutoff = time.time() - max_age
+    for directory, _, names in os.walk(root):
+        for name in names:
+            if not (name.startswith('.') and name.endswith(TEMP_SUFFIX)):
+                continue
+            path = os.path.join(directory, name)
+            try:
+                if os.path.getmtime(path) < cutoff:
+                    os.remove(path)
+                    removed += 1
+            except OSError:
+                pass
+    return removed
+
+def file_synced(fsync):
+    """Whether the fsync policy flushes every file before renaming it into place."""
+    return fsync != 'never'
+
+def dir_synced(fsync):
+    """Whether the fsync policy flushes every directory right after a rename into it."""
+    return fsync == 'always'
+
+class WritePolicy:
+    """
+    How hard saved images are pushed to disk. Every file is written to a
+    temporary file and renamed into place, so a killed run never leaves a
+    truncated image behind; the fsync policy decides what survives a power
+    loss. 'always' and 'batch' flush every file before its rename, so a
+    renamed image is never empty or truncated. 'always' then flushes the
+    directory as well, 'batch' syncs the directories written to once every
+    batch_size saved images and when the run ends, so a crash may lose the
+    newest renames but never leaves a damaged file. 'never' leaves it all to
+    the OS.
+    """
+
+    def __init__(self, fsync='batch', batch_size=FSYNC_BATCH_SIZE):
+        self.fsync = fsync
+        self.batch_size = batch_size
+        self._unsynced = 0
+        self._directories = set()
+        self._lock = threading.Lock()
+
+    @property
+    def per_file(self):
+        return self.fsync == 'always'
+
+    def saved(self, directories=()):
+        """Note one saved image and the directories it was renamed into, syncing when a batch is complete."""
+        if self.fsync != 'batch':
+            return
+        with self._lock:
+            self._unsynced += 1
+            self._directories.update(directories)
+            if self._unsynced < self.batch_size:
+                return
+            self._unsynced = 0
+            directories, self._directories = self._directories, set()
+        self._sync(directories)
+
+    def flush(self):
+        """Sync the directories the current batch has written to so far."""
+        with self._lock:
+            self._unsynced = 0
+            directories, self._directories = self._directories, set()
+        self._sync(directories)
+
+    @staticmethod
+    def _sync(directories):
+        for directory in sorted(directories):
+            try:
+                fsync_path(directory)
+            except FileNotFoundError:
+                pass
+
+def write_json_atomic(path, data):
+    """Write JSON to a temporary file next to path and rename it into place."""
+    with atomic_write(path) as tmp_path:
+        with open(tmp_path, 'w') as f:
+            json.dump(data, f, indent=1, sort_keys=True)
+
+def response_validators(headers):
+    """The caching headers of a response that a later conditional request needs."""
+    return {
+        'etag': headers.get('ETag'),
+        'last_modified': headers.get('Last-Modified'),
+        'cache_control': headers.get('Cache-Control'),
+    }
+
+def parse_max_age(cache_control):
+    """max-age in seconds from a Cache-Control header; 0 when revalidation is required."""
+    max_age = 0
+    for directive in (cache_control or '').lower().split(','):
+        name, _, value = directive.strip().partition('=')
+        if name in ('no-cache', 'no-store'):
+            return 0
+        if name == 'max-age' and value.strip().isdigit():
+            max_age = int(value)
+    return max_age
+
+class HttpCache:
+    """
+    On-disk cache of response validators (ETag, Last-Modified, Cache-Control)
+    so refresh runs can send conditional requests. Entries are keyed by source
+    URL; the placeholder sources serve every actor from the same URL, so the
+    actor's slug is appended as a fragment to keep the keys distinct.
+    """
+
+    # Write the cache to disk after this many updates, and again on close
+    SAVE_EVERY = 100
+
+    def __init__(self, path):
+        self.path = path
+        self.entries = {}
+        self.dirty = 0
+        self._lock = threading.Lock()
+        try:
+            with open(path) as f:
+                self.entries = json.load(f)
+        except FileNotFoundError:
+            pass
+        except ValueError:
+            print(f"Ignoring unreadable HTTP cache {path}")
+
+    @staticmethod
+    def key(clean_name, url):
+        return f"{url}#{clean_name}"
+
+    def find(self, clean_name, urls):
+        """Return (url, entry) for the first source with cached validators, or (None, None)."""
+        with self._lock:
+            for url in urls:
+                entry = self.entries.get(self.key(clean_name, url))
+                if entry:
+                    return url, dict(entry)
+        return None, None
+
+    def store(self, clean_name, url, validators):
+        if 'no-store' in (validators.get('cache_control') or '').lower():
+            return
+        if not validators.get('etag') and not validators.get('last_modified'):
+            return
+        with self._lock:
+            entry = self.entries.setdefault(self.key(clean_name, url), {})
+            entry.update({k: v for k, v in validators.items() if v is not None})
+            entry['checked_at'] = time.time()
+            self.dirty += 1
+            save = self.dirty >= self.SAVE_EVERY
+        if save:
+            self.save()
+
+    @staticmethod
+    def is_fresh(entry):
+        """True while Cache-Control max-age says the stored image needs no revalidation."""
+        return time.time() - entry.get('checked_at', 0) < parse_max_age(entry.get('cache_control'))
+
+    @staticmethod
+    def conditional_headers(entry):
+        headers = {}
+        if entry.get('etag'):
+            headers['If-None-Match'] = entry['etag']
+        if entry.get('last_modified'):
+            headers['If-Modified-Since'] = entry['last_modified']
+        return headers
+
+    def save(self):
+        with self._lock:
+            if not self.dirty:
+                return
+            os.makedirs(os.path.dirname(self.path) or '.', exist_ok=True)
+            write_json_atomic(self.path, self.entries)
+            self.dirty = 0
+
+class NegativeCache:
+    """
+    On-disk cache of sources that recently failed for an actor. Each entry
+    blocks one source for one actor until its TTL expires; every further
+    failure doubles the TTL, a success removes the entry. Keys follow
+    HttpCache.key(). With enforce=False failures are still recorded but
+    nothing is skipped.
+    """
+
+    SAVE_EVERY = 100
+
+    def __init__(self, path, ttl=NEGATIVE_TTL, max_ttl=NEGATIVE_MAX_TTL, enforce=True):
+        self.path = path
+        self.ttl = ttl
+        self.max_ttl = max_ttl
+        self.enforce = enforce
+        self.entries = {}
+        self.dirty = 0
+        self._lock = threading.Lock()
+        try:
+            with open(path) as f:
+                self.entries = json.load(f)
+        except FileNotFoundError:
+            pass
+        except ValueError:
+            print(f"Ignoring unreadable negative cache {path}")
+
+    def blocked(self, clean_name, url):
+        """True while a recent failure of url for this actor has not expired."""
+        if not self.enforce:
+            return False
+        with self._lock:
+            entry = self.entries.get(HttpCache.key(clean_name, url))
+        return entry is not None and entry['until'] > time.time()
+
+    def record(self, clean_name, url, error):
+        key = HttpCache.key(clean_name, url)
+        with self._lock:
+            failures = self.entries.get(key, {}).get('failures', 0) + 1
+            ttl = min(self.max_ttl, self.ttl * 2 ** (failures - 1))
+            self.entries[key] = {'failures': failures, 'until': time.time() + ttl, 'error': str(error)}
+            self.dirty += 1
+            save = self.dirty >= self.SAVE_EVERY
+        if save:
+            self.save()
+
+    def clear(self, clean_name, url):
+        with self._lock:
+            if self.entries.pop(HttpCache.key(clean_name, url), None) is not None:
+                self.dirty += 1
+
+    def save(self):
+        with self._lock:
+            if not self.dirty:
+                return
+            os.makedirs(os.path.dirname(self.path) or '.', exist_ok=True)
+            write_json_atomic(self.path, self.entries)
+            self.dirty = 0
+
+def file_digest(path, chunk_size=1024 * 1024):
+    """SHA-256 hex digest of a file's contents."""
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+class BlobStore:
+    """
+    Content-addressed store of encoded images, one file per SHA-256 of the
+    bytes. actors_images/<slug>.png entries are hard links into the store
+    (or copies where hard links are not possible), so identical images are
+    kept on disk once.
+    """
+
+    def __init__(self, root):
+        self.root = root
+
+    def blob_path(self, digest):
+        return os.path.join(self.root, digest[:2], f"{digest}.png")
+
+    def temp_path(self):
+        os.makedirs(self.root, exist_ok=True)
+        return temp_path_for(os.path.join(self.root, "incoming.png"))
+
+    def add(self, path):
+        """
+        Move the file at path into the store, or drop it if an identical blob
+        already exists. Returns (digest, is_new).
+        """
+        digest = file_digest(path)
+        blob = self.blob_path(digest)
+        if os.path.exists(blob):
+            os.remove(path)
+            return digest, False
+        os.makedirs(os.path.dirname(blob), exist_ok=True)
+        os.replace(path, blob)
+        return digest, True
+
+    def link(self, digest, output_path):
+        """Point output_path at the blob, replacing whatever was there."""
+        blob = self.blob_path(digest)
+        if os.path.exists(output_path) and os.path.samefile(blob, output_path):
+            return
+        with atomic_write(output_path) as tmp_path:
+            try:
+                os.link(blob, tmp_path)
+            except OSError:
+                shutil.copyfile(blob, tmp_path)
+
+    def adopt(self, path):
+        """
+        Bring an existing image into the store. Returns (digest, bytes_saved),
+        where bytes_saved is the size of the file if an identical blob already existed.
+        """
+        digest = file_digest(path)
+        blob = self.blob_path(digest)
+        if not os.path.exists(blob):
+            os.makedirs(os.path.dirname(blob), exist_ok=True)
+            try:
+                os.link(path, blob)
+            except OSError:
+                shutil.copyfile(path, blob)
+            return digest, 0
+        if os.path.samefile(blob, path):
+            return digest, 0
+        size = os.path.getsize(path)
+        self.link(digest, path)
+        return digest, size
+
+class AssetManifest:
+    """
+    SQLite index of every actor image: slug, source, content hash,
+    dimensions, byte size, mtime and status. Startup reads the finished
+    slugs with one indexed query instead of probing the filesystem per actor.
+    """
+
+    def __init__(self, path):
+        os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+        self.path = path
+        self.deduplicated = 0
+        self.bytes_saved = 0
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(path, check_same_thread=False)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("PRAGMA synchronous=NORMAL")
+        self._db.execute("""
+            CREATE TABLE IF NOT EXISTS assets (
+                slug TEXT PRIMARY KEY,
+                actor TEXT,
+                source TEXT,
+                hash TEXT,
+                width INTEGER,
+                height INTEGER,
+                bytes INTEGER,
+                mtime REAL,
+                status TEXT NOT NULL,
+                updated_at REAL NOT NULL,
+                extension TEXT
+            )""")
+        # Manifests written before the extension column existed gain it here
+        if 'extension' not in {row[1] for row in self._db.execute("PRAGMA table_info(assets)")}:
+            self._db.execute("ALTER TABLE assets ADD COLUMN extension TEXT")
+        self._db.execute("CREATE INDEX IF NOT EXISTS assets_status ON assets (status)")
+        self._db.execute("""
+            CREATE TABLE IF NOT EXISTS variants (
+                slug TEXT NOT NULL,
+                width INTEGER NOT NULL,
+                height INTEGER NOT NULL,
+                bytes INTEGER NOT NULL,
+                PRIMARY KEY (slug, width)
+            )""")
+        self._db.execute("""
+            CREATE TABLE IF NOT EXISTS encodings (
+                slug TEXT NOT NULL,
+                width INTEGER NOT NULL,
+                variant INTEGER NOT NULL,
+                format TEXT NOT NULL,
+                setting TEXT,
+                bytes INTEGER,
+                PRIMARY KEY (slug, width, format)
+            )""")
+        self._db.execute("""
+            CREATE TABLE IF NOT EXISTS directories (
+                path TEXT PRIMARY KEY,
+                mtime_ns INTEGER NOT NULL
+            )""")
+        self._db.commit()
+
+    def _query(self, sql, params=()):
+        with self._lock:
+            return self._db.execute(sql, params).fetchall()
+
+    def _write(self, sql, rows):
+        with self._lock:
+            self._db.executemany(sql, rows)
+            self._db.commit()
+
+    def done_slugs(self):
+        """Set of slugs whose image is stored."""
+        return {row[0] for row in self._query("SELECT slug FROM assets WHERE status = 'done'")}
+
+    def is_done(self, clean_name):
+        return bool(self._query("SELECT 1 FROM assets WHERE slug = ? AND status = 'done'", (clean_name,)))
+
+    def hash_for(self, clean_name):
+        rows = self._query("SELECT hash FROM assets WHERE slug = ?", (clean_name,))
+        return rows[0][0] if rows else None
+
+    def record_image(self, clean_name, path, actor=None, source=None, digest=None, size=None,
+                     duplicate_bytes=0):
+        """
+        Record a stored image; columns that are not given keep their previous
+        value. Once path holds real PNG data a recorded extension is cleared.
+        """
+        stat = os.stat(path)
+        width, height = size or (None, None)
+        self._write("""
+            INSERT INTO assets (slug, actor, source, hash, width, height, bytes, mtime, status, updated_at)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?, 'done', ?)
+            ON CONFLICT (slug) DO UPDATE SET
+                actor = COALESCE(excluded.actor, actor),
+                source = COALESCE(excluded.source, source),
+                hash = COALESCE(excluded.hash, hash),
+                width = COALESCE(excluded.width, width),
+                height = COALESCE(excluded.height, height),
+                bytes = excluded.bytes, mtime = excluded.mtime,
+                status = 'done', updated_at = excluded.updated_at,
+                extension = CASE WHEN ? THEN NULL ELSE extension END""",
+            [(clean_name, actor, source, digest, width, height, stat.st_size, stat.st_mtime, time.time(),
+              sniff_format(path) == 'PNG')])
+        if duplicate_bytes:
+            with self._lock:
+                self.deduplicated += 1
+                self.bytes_saved += duplicate_bytes
+
+    def record_extension(self, clean_name, extension):
+        """Record that an image is served under the extension of its real format instead of .png."""
+        self._write("UPDATE assets SET extension = ? WHERE slug = ?", [(extension, clean_name)])
+
+    def extensions(self):
+        """Map of slug to the extension of every image not served as .png."""
+        return dict(self._query("SELECT slug, extension FROM assets WHERE extension IS NOT NULL"))
+
+    def record_variants(self, clean_name, variants):
+        """Record the (width, height, bytes) size variants saved for an image."""
+        self._write("INSERT OR REPLACE INTO variants (slug, width, height, bytes) VALUES (?, ?, ?, ?)",
+                    [(clean_name, width, height, size) for width, height, size in variants])
+
+    def variant_widths(self, clean_name):
+        return {row[0] for row in self._query("SELECT width FROM variants WHERE slug = ?", (clean_name,))}
+
+    def all_variants(self):
+        """Map of slug to the sorted widths of its size variants."""
+        variants = {}
+        for slug, width in self._query("SELECT slug, width FROM variants ORDER BY slug, width"):
+            variants.setdefault(slug, []).append(width)
+        return variants
+
+    def record_encodings(self, clean_name, encodings):
+        """
+        Record the (width, is_variant, format, setting, bytes) modern encodings
+        of an image; setting and bytes are None where no candidate qualified.
+        """
+        self._write("""
+            INSERT OR REPLACE INTO encodings (slug, width, variant, format, setting, bytes)
+            VALUES (?, ?, ?, ?, ?, ?)""",
+            [(clean_name, width, int(is_variant), fmt, setting, size)
+             for width, is_variant, fmt, setting, size in encodings])
+
+    def record_size(self, clean_name, size):
+        self._write("UPDATE assets SET width = ?, height = ? WHERE slug = ?", [(size[0], size[1], clean_name)])
+
+    def encoded(self, clean_name):
+        """Set of (width, format) pairs already tried for an image."""
+        return set(self._query("SELECT width, format FROM encodings WHERE slug = ?", (clean_name,)))
+
+    def picture_sources(self):
+        """
+        Map of slug to {format: [(width, is_variant, bytes), ...]} for every
+        written modern encoding, plus the PNG original and variants.
+        """
+        sources = {}
+        for slug, width in self._query("SELECT slug, width FROM assets WHERE status = 'done' AND width IS NOT NULL"):
+            sources.setdefault(slug, {}).setdefault('PNG', []).append((width, False, None))
+        for slug, width, size in self._query("SELECT slug, width, bytes FROM variants"):
+            sources.setdefault(slug, {}).setdefault('PNG', []).append((width, True, size))
+        for slug, width, variant, fmt, size in self._query(
+                "SELECT slug, width, variant, format, bytes FROM encodings WHERE bytes IS NOT NULL"):
+            sources.setdefault(slug, {}).setdefault(fmt, []).append((width, bool(variant), size))
+        for formats in sources.values():
+            for entries in formats.values():
+                entries.sort()
+        return sources
+
+    def record_failure(self, clean_name, actor):
+        """Record that no image could be downloaded; a stored image is never downgraded."""
+        self._write("""
+            INSERT INTO assets (slug, actor, status, updated_at) VALUES (?, ?, 'failed', ?)
+            ON CONFLICT (slug) DO UPDATE SET status = 'failed', updated_at = excluded.updated_at
+            WHERE status != 'done'""",
+            [(clean_name, actor, time.time())])
+
+    def sync_directory(self, output_dir, force=False):
+        """
+        Index the images in output_dir with one directory scan, and mark
+        entries whose file has disappeared as missing. Only rows whose file
+        changed on disk are rewritten, dropping their hash. The scan is
+        skipped while the directory's mtime is the one recorded by
+        mark_synced, unless force is given. Returns (images found, images
+        missing), or None when nothing was scanned.
+        """
+        mtime_ns = os.stat(output_dir).st_mtime_ns
+        rows = self._query("SELECT mtime_ns FROM directories WHERE path = ?", (os.path.abspath(output_dir),))
+        if not force and rows and rows[0][0] == mtime_ns:
+            return None
+        now = time.time()
+        rows = []
+        for entry in os.scandir(output_dir):
+            if entry.name.endswith('.png') and entry.is_file():
+                stat = entry.stat()
+                rows.append((entry.name[:-len('.png')], stat.st_size, stat.st_mtime, now))
+        found = {row[0] for row in rows}
+        self._write("""
+            INSERT INTO assets (slug, bytes, mtime, status, updated_at) VALUES (?, ?, ?, 'done', ?)
+            ON CONFLICT (slug) DO UPDATE SET
+                hash = CASE WHEN bytes = excluded.bytes AND mtime = excluded.mtime THEN hash END,
+                bytes = excluded.bytes, mtime = excluded.mtime,
+                status = 'done', updated_at = excluded.updated_at
+            WHERE bytes IS NOT excluded.bytes OR mtime IS NOT excluded.mtime OR status != 'done'""", rows)
+        missing = [(now, slug) for slug in self.done_slugs() - found]
+        self._write("UPDATE assets SET status = 'missing', updated_at = ? WHERE slug = ?", missing)
+        self.mark_synced(output_dir, mtime_ns)
+        return len(rows), len(missing)
+
+    def mark_synced(self, output_dir, mtime_ns=None):
+        """
+        Record the mtime of output_dir once every image in it is known to the
+        manifest, so the next sync_directory can skip the scan.
+        """
+        if mtime_ns is None:
+            mtime_ns = os.stat(output_dir).st_mtime_ns
+        self._write("INSERT OR REPLACE INTO directories (path, mtime_ns) VALUES (?, ?)",
+                    [(os.path.abspath(output_dir), mtime_ns)])
+
+    def report(self):
+        rows = self._query("SELECT status, COUNT(*), COUNT(DISTINCT hash), SUM(bytes) FROM assets GROUP BY status")
+        for status, count, hashes, size in rows:
+            print(f"  {status}: {count} images, {hashes} distinct hashes, {size or 0} bytes")
+        if self.deduplicated:
+            print(f"  {self.deduplicated} duplicates linked to existing blobs ({self.bytes_saved} bytes saved)")
+
+    def merge(self, path, slugs):
+        """
+        Merge the manifest of a shard into this one. The rows of the given
+        slugs, whose images were copied over from the shard, replace existing
+        rows; the shard's failures only fill in slugs this manifest does not
+        know yet. Returns the number of stored images merged.
+        """
+        columns = "slug, actor, source, hash, width, height, bytes, mtime, status, updated_at, extension"
+        with self._lock:
+            self._db.execute("ATTACH DATABASE ? AS shard", (path,))
+            try:
+                self._db.execute("CREATE TEMP TABLE merged_slugs (slug TEXT PRIMARY KEY)")
+                self._db.executemany("INSERT OR IGNORE INTO merged_slugs VALUES (?)", [(slug,) for slug in slugs])
+                merged = self._db.execute(f"""
+                    INSERT OR REPLACE INTO assets ({columns})
+                    SELECT {columns} FROM shard.assets
+                    WHERE status = 'done' AND slug IN (SELECT slug FROM merged_slugs)""").rowcount
+                self._db.execute(f"""
+                    INSERT OR IGNORE INTO assets ({columns})
+                    SELECT {columns} FROM shard.assets WHERE status != 'done'""")
+                self._db.execute("""
+                    INSERT OR REPLACE INTO variants (slug, width, height, bytes)
+                    SELECT slug, width, height, bytes FROM shard.variants
+                    WHERE slug IN (SELECT slug FROM merged_slugs)""")
+                self._db.execute("""
+                    INSERT OR REPLACE INTO encodings (slug, width, variant, format, setting, bytes)
+                    SELECT slug, width, variant, format, setting, bytes FROM shard.encodings
+                    WHERE slug IN (SELECT slug FROM merged_slugs)""")
+                self._db.commit()
+            finally:
+                self._db.execute("DROP TABLE IF EXISTS temp.merged_slugs")
+                self._db.execute("DETACH DATABASE shard")
+        return merged
+
+    def close(self):
+        with self._lock:
+            self._db.close()
+
+def is_transient_failure(error):
+    """
+    True for failures that may go away on their own: everything the retry
+    policy retries, plus open circuits and failed DNS lookups.
+    """
+    return RetryPolicy.is_retryable(error) or isinstance(error, SourceUnavailable) or is_dns_failure(error)
+
+class RunJournal:
+    """
+    Append-only JSON-lines log of per-actor outcomes: success, fatal failure
+    (every source answered with a permanent error) or retryable failure with
+    the time the actor is next eligible. The journal is replayed on start, so
+    a resumed run skips actors known to be dead or still backing off instead
+    of spending full timeouts on them again. A torn last line from a crash is
+    ignored.
+    """
+
+    def __init__(self, path, base_delay=JOURNAL_RETRY_BASE_DELAY, max_delay=JOURNAL_RETRY_MAX_DELAY,
+                 fsync=False):
+        os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+        self.path = path
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.fsync = fsync
+        self.entries = {}
+        self._lock = threading.Lock()
+        lines = self._replay()
+        if lines - len(self.entries) >= JOURNAL_COMPACT_MIN_LINES:
+            self._compact()
+        self._file = open(path, 'a')
+
+    def _replay(self):
+        lines = 0
+        try:
+            with open(self.path) as f:
+                for line in f:
+                    lines += 1
+                    try:
+                        entry = json.loads(line)
+                    except ValueError:
+                        continue
+                    self.entries[entry['slug']] = entry
+        except FileNotFoundError:
+            pass
+        return lines
+
+    def _compact(self):
+        """Rewrite the journal with only the latest entry per actor."""
+        with atomic_write(self.path, self.fsync) as tmp_path:
+            with open(tmp_path, 'w') as f:
+                for entry in self.entries.values():
+                    f.write(json.dumps(entry, sort_keys=True) + "\n")
+
+    def record(self, actor_name, outcome, error=None):
+        """Append the outcome ('success', 'fatal' or 'retryable') of one actor."""
+        clean_name = clean_name_for_file(actor_name)
+        now = time.time()
+        with self._lock:
+            previous = self.entries.get(clean_name)
+            failures = 0
+            if outcome != 'success':
+                failures = previous['failures'] + 1 if previous and previous['outcome'] != 'success' else 1
+            entry = {'slug': clean_name, 'actor': actor_name, 'outcome': outcome,
+                     'time': now, 'failures': failures}
+            if error is not None:
+                entry['error'] = str(error)
+            if outcome == 'retryable':
+                entry['retry_at'] = now + min(self.max_delay, self.base_delay * 2 ** (failures - 1))
+            self.entries[clean_name] = entry
+            self._file.write(json.dumps(entry, sort_keys=True) + "\n")
+            self._file.flush()
+            if self.fsync:
+                os.fsync(self._file.fileno())
+
+    def state(self, actor_name, now=None):
+        """'dead', 'waiting' or None for an actor that may be attempted now."""
+        entry = self.entries.get(clean_name_for_file(actor_name))
+        if not entry or entry['outcome'] == 'success':
+            return None
+        if entry['outcome'] == 'fatal':
+            return 'dead'
+        return 'waiting' if entry['retry_at'] > (now or time.time()) else None
+
+    def close(self):
+        with self._lock:
+            self._file.close()
+
+def adopt_existing_images(output_dir, blob_store, manifest):
+    """Move existing images whose manifest entry has no blob yet into the blob store."""
+    for entry in os.scandir(output_dir):
+        if not entry.name.endswith('.png') or not entry.is_file():
+            continue
+        clean_name = entry.name[:-len('.png')]
+        digest = manifest.hash_for(clean_name)
+        if digest and os.path.exists(blob_store.blob_path(digest)) \
+                and os.path.samefile(blob_store.blob_path(digest), entry.path):
+            continue
+        digest, saved = blob_store.adopt(entry.path)
+        manifest.record_image(clean_name, entry.path, digest=digest, duplicate_bytes=saved)
+
+def create_session(per_host=4):
+    """
+    Create a keep-alive HTTP session shared by every actor and attempt.
+    Each host, including the CDN hosts the sources redirect to, gets its own
+    connection pool sized to the per-host cap, so TCP and TLS handshakes are
+    paid once per host instead of once per image.
+    """
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=max(POOLED_HOSTS, len(PLACEHOLDER_URLS)), pool_maxsize=per_host)
+    session.mount('https://', adapter)
+    session.mount('http://', adapter)
+    return session
+
+class DownloadContext:
+    """
+    State shared by every download in a run: the pooled HTTP session and
+    the per-host request and rate limits. The asyncio pipeline passes its
+    aiohttp session in place of the requests session.
+    """
+
+    def __init__(self, per_host=4, stream=False, max_bytes=DEFAULT_MAX_BYTES, staging_dir=None,
+                 rate_limiter=None, session=None, host_limiter=None, hedge=False, hedge_delay=None,
+                 hedge_workers=None, health=None, retry_policy=None, http_cache=None, refresh=False,
+                 blob_store=None, manifest=None, encoder=None, outputs=None, target_size=None,
+                 strip_metadata=True, icc='keep', writes=None, journal=None, negative_cache=None):
+        self.host_limiter = host_limiter or HostLimiter(per_host)
+        if session is None:
+            session = create_session(self.host_limiter.max_per_host)
+        self.session = session
+        self.rate_limiter = rate_limiter
+        self.stats = RunStats()
+        self.health = health or SourceHealth()
+        self.retry_policy = retry_policy or RetryPolicy()
+        # Validators of past downloads; with refresh=True existing images are revalidated
+        self.http_cache = http_cache
+        self.refresh = refresh
+        # Saved images are recorded in the manifest; with a blob store they are deduplicated
+        self.blob_store = blob_store
+        self.manifest = manifest
+        # Per-actor outcomes are appended here so the next run can skip dead actors
+        self.journal = journal
+        # Sources that recently failed for an actor are skipped for that actor
+        self.negative_cache = negative_cache
+        # When set, PNG encoding is handed to this process pool pipeline
+        self.encoder = encoder
+        # Size variants and modern formats saved next to every image
+        self.outputs = outputs
+        # Downloaded images larger than this (width, height) are scaled down while decoding
+        self.target_size = target_size
+        # Saved images lose their EXIF/text metadata; icc is the ICC profile policy
+        self.strip_metadata = strip_metadata
+        self.icc = icc
+        # Saved files are renamed into place and synced according to this policy
+        self.writes = writes or WritePolicy()
+        self.stream = stream
+        self.max_bytes = max_bytes
+        # When set, partial bodies are kept here and resumed with Range requests
+        self.staging_dir = staging_dir
+        if staging_dir:
+            os.makedirs(staging_dir, exist_ok=True)
+        # Hedging races the sources; hedge_delay=None derives the delay from observed latency
+        self.hedge = hedge
+        self.hedge_delay = hedge_delay
+        self.hedge_pool = None
+        if hedge and hedge_workers:
+            self.hedge_pool = ThreadPoolExecutor(max_workers=hedge_workers)
+
+    def source_order(self, clean_name=None):
+        """
+        Attempt numbers in the order the sources should be tried. Given an
+        actor's slug, sources the negative cache is holding back are left out.
+        """
+        order = self.health.order(PLACEHOLDER_URLS)
+        if clean_name and self.negative_cache:
+            order = [attempt for attempt in order
+                     if not self.negative_cache.blocked(clean_name, PLACEHOLDER_URLS[attempt - 1])]
+        return order
+
+    def source_failed(self, actor_name, attempt, error):
+        """
+        Put a source that gave up on an actor into the negative cache. Open
+        circuits and cancelled hedges say nothing about the actor and are not
+        recorded.
+        """
+        if self.negative_cache and not isinstance(error, (SourceUnavailable, DownloadCancelled)):
+            self.negative_cache.record(clean_name_for_file(actor_name), PLACEHOLDER_URLS[attempt - 1], error)
+
+    def hedge_delay_for(self, url):
+        """How long to wait on a request to url before starting the next source."""
+        if self.hedge_delay is not None:
+            return self.hedge_delay
+        observed = self.stats.latency_percentile(url, HEDGE_PERCENTILE, HEDGE_MIN_SAMPLES)
+        return observed if observed is not None else DEFAULT_HEDGE_DELAY
+
+    def partial_path(self, clean_name, url):
+        """Staging file for a partially downloaded body of one actor from one source."""
+        host = urlparse(url).netloc.replace(':', '_')
+        return os.path.join(self.staging_dir, f"{clean_name}.{host}.part")
+
+    @contextmanager
+    def request_slot(self, url):
+        """
+        Wait for a free request slot and a rate token on the host of the given URL,
+        then time the request and feed the outcome to the stats and host limit.
+        """
+        limit = self.host_limiter.acquire(url)
+        started = None
+        error = None
+        try:
+            if self.rate_limiter:
+                time.sleep(self.rate_limiter.reserve(url))
+            started = time.monotonic()
+            yield
+        except Exception as e:
+            error = e
+            raise
+        finally:
+            if started is None:
+                limit.release()
+            else:
+                latency = time.monotonic() - started
+                limit.release(latency, error is not None and is_congestion_error(error))
+                self.stats.record(url, latency, error)
+
+    @asynccontextmanager
+    async def async_request_slot(self, url):
+        """Event-loop counterpart of request_slot(); the connector enforces the host cap."""
+        if self.rate_limiter:
+            await asyncio.sleep(self.rate_limiter.reserve(url))
+        started = time.monotonic()
+        error = None
+        try:
+            yield
+        except Exception as e:
+            error = e
+            raise
+        finally:
+            self.stats.record(url, time.monotonic() - started, error)
+
+    def report(self):
+        """Print per-host run statistics, including adaptive concurrency limits."""
+        print("Per-host statistics:")
+        limits = self.host_limiter.current_limits() if self.host_limiter.adaptive else None
+        self.stats.report(limits)
+        print("Source health:")
+        self.health.report()
+        self.retry_policy.report()
+        if self.stats.stripped_images:
+            print(f"Metadata: removed {self.stats.stripped_bytes} bytes of ICC profiles "
+                  f"from {self.stats.stripped_images} images")
+        if self.manifest:
+            print("Asset manifest:")
+            self.manifest.report()
+
+    def observe_response(self, url, status_code, headers):
+        """
+        Pause the host when it signals throttling with 429 or Retry-After.
+        url is the URL that was requested, not the one a redirect ended on,
+        so the pause applies to the host whose requests are being paced.
+        """
+        if not self.rate_limiter or status_code not in (429, 503):
+            return
+        delay = parse_retry_after(headers.get('Retry-After'))
+        if delay is None and status_code == 429:
+            delay = DEFAULT_THROTTLE_PAUSE
+        if delay:
+            print(f"{urlparse(url).netloc} is throttling (HTTP {status_code}), pausing it for {delay:.1f}s")
+            self.rate_limiter.pause(url, delay)
+
+    def close(self):
+        if self.hedge_pool:
+            self.hedge_pool.shutdown(wait=True)
+        if self.http_cache:
+            self.http_cache.save()
+        self.writes.flush()
+        self.session.close()
+
+def shard_of(clean_name, count):
+    """
+    Shard an actor slug belongs to out of count. Based on SHA-256 rather
+    than hash(), so every host and Python process agrees on the split.
+    """
+    return int(hashlib.sha256(clean_name.encode('utf-8')).hexdigest()[:16], 16) % count
+
+def stored_slugs(directory):
+    """Slugs of the actor images stored directly in directory."""
+    if not os.path.isdir(directory):
+        return set()
+    return {entry.name[:-len('.png')] for entry in os.scandir(directory)
+            if entry.name.endswith('.png') and entry.is_file()}
+
+def shard_dir(index, count):
+    """Working directory of one shard: its images, state and link files."""
+    return os.path.join(SHARDS_DIR, f"{index}-of-{count}")
+
+def load_roster(path):
+    """Actor names from a roster file, one per line; blank lines and # comments are skipped."""
+    with open(path, encoding='utf-8') as f:
+        names = [line.strip() for line in f]
+    return [name for name in names if name and not name.startswith('#')]
+
+def create_cdn_link(actor_name, width=None, extension='.png'):
+    """Create the CDN link in the required format, for the original or one size variant."""
     clean_name = clean_name_for_file(actor_name)
-    return f"https://cdn.jsdelivr.net/gh/talentZ-A/talent-z-assets/talents/actors_images/{clean_name}.png"
+    if width:
+        return f"https://cdn.jsdelivr.net/gh/talentZ-A/talent-z-assets/talents/actors_images/{VARIANTS_DIR}/{width}/{clean_name}{extension}"
+    return f"https://cdn.jsdelivr.net/gh/talentZ-A/talent-z-assets/talents/actors_images/{clean_name}{extension}"
 
-def download_image(actor_name, attempt=1, max_attempts=3):
+def picture_element(actor_name, sources, extension='.png'):
     """
-    Download an image of the actor using a more reliable API.
-    Returns the image object if successful, None otherwise.
+    A <picture> element for an actor from its manifest picture sources:
+    one <source> per modern format, smallest first, and the PNG as fallback.
+    extension is the one the original is served under.
+    """
+    def link(fmt, width, is_variant):
+        if fmt == 'PNG' and not is_variant:
+            return create_cdn_link(actor_name, extension=extension)
+        return create_cdn_link(actor_name, width if is_variant else None, EXTENSIONS[fmt])
+    
+    def srcset(fmt):
+        return ", ".join(f"{link(fmt, width, is_variant)} {width}w" for width, is_variant, _ in sources[fmt])
+    
+    modern = sorted((fmt for fmt in sources if fmt != 'PNG'), key=lambda fmt: sources[fmt][-1][2])
+    lines = ["<picture>"]
+    lines += [f'  <source type="{MIME_TYPES[fmt]}" srcset="{srcset(fmt)}">' for fmt in modern]
+    png_srcset = f' srcset="{srcset("PNG")}"' if sources.get('PNG') else ""
+    lines.append(f'  <img src="{create_cdn_link(actor_name, extension=extension)}"{png_srcset} alt="{actor_name}">')
+    lines.append("</picture>")
+    return "\n".join(lines)
+
+def write_link_files(actors, successful_actors, manifest, directory="", variants=False, formats=False):
+    """
+    Write the CDN link files for the successfully processed actors into
+    directory: the plain links, and with variants / formats the srcset
+    lines and <picture> elements built from the manifest. Images recorded
+    under the extension of their real format are linked with it. Returns the
+    path of the plain link file.
     """
-    # User agents to avoid being blocked
-    user_agents = [
-        'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36',
-        'Mozilla/5.0 (Macintosh; Intel Mac OS X 10_15_7) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36',
-        'Mozilla/5.0 (Windows NT 10.0; Win64; x64; rv:89.0) Gecko/20100101 Firefox/89.0'
-    ]
+    extensions = manifest.extensions()
     
-    headers = {
-        'User-Agent': random.choice(user_agents),
+    # Create the text file with CDN links
+    txt_path = os.path.join(directory, "actor_image_links.txt")
+    with open(txt_path, 'w') as f:
+        for actor in actors:  # Generate links for ALL actors
+            cdn_link = create_cdn_link(actor, extension=extensions.get(clean_name_for_file(actor), '.png'))
+            # Only write links for successfully downloaded images
+            if actor in successful_actors:
+                f.write(f"{cdn_link}\n")
+    
+    if variants:
+        # One srcset-ready line per actor listing the CDN link of every size variant
+        variant_widths = manifest.all_variants()
+        variants_path = os.path.join(directory, "actor_image_variant_links.txt")
+        with open(variants_path, 'w') as f:
+            for actor in actors:
+                widths = variant_widths.get(clean_name_for_file(actor))
+                if actor in successful_actors and widths:
+                    f.write(", ".join(f"{create_cdn_link(actor, width)} {width}w" for width in widths) + "\n")
+        print(f"Size variant links saved to {variants_path}")
+    
+    if formats:
+        # <picture> elements with WebP/AVIF sources and the PNG as fallback
+        picture_sources = manifest.picture_sources()
+        picture_path = os.path.join(directory, "actor_image_picture_links.html")
+        with open(picture_path, 'w') as f:
+            for actor in actors:
+                if actor in successful_actors:
+                    clean_name = clean_name_for_file(actor)
+                    sources = picture_sources.get(clean_name, {})
+                    f.write(picture_element(actor, sources, extensions.get(clean_name, '.png')) + "\n")
+        print(f"Picture link sets saved to {picture_path}")
+    return txt_path
+
+def build_headers():
+    """Build request headers with a randomly chosen user agent."""
+    return {
+        'User-Agent': random.choice(USER_AGENTS),
         'Accept': 'text/html,application/xhtml+xml,application/xml;q=0.9,image/webp,*/*;q=0.8',
     }
+
+def check_content_length(headers, max_bytes):
+    """Reject a response up front if its declared size is over max_bytes."""
+    length = headers.get('Content-Length')
+    if max_bytes and length and length.isdigit() and int(length) > max_bytes:
+        raise ImageTooLarge(f"Image is {length} bytes, limit is {max_bytes}")
+
+def stream_to_file(response, max_bytes, chunk_size=STREAM_CHUNK_SIZE, cancel=None):
+    """
+    Stream a requests response body into an anonymous temporary file so only
+    one chunk is held in memory at a time. Returns the file rewound to the start.
+    """
+    check_content_length(response.headers, max_bytes)
+    body = tempfile.TemporaryFile()
+    try:
+        size = 0
+        for chunk in response.iter_content(chunk_size):
+            check_cancelled(cancel)
+            size += len(chunk)
+            if max_bytes and size > max_bytes:
+                raise ImageTooLarge(f"Image exceeds the {max_bytes} byte limit")
+            body.write(chunk)
+        body.seek(0)
+        return body
+    except Exception:
+        body.close()
+        raise
+
+def load_partial_meta(part_path):
+    """Load the validators recorded for a staged partial body, or None."""
+    try:
+        with open(part_path + '.json') as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+def discard_partial(part_path):
+    """Remove a staged partial body and its metadata."""
+    for path in (part_path, part_path + '.json'):
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+
+def parse_content_range(value):
+    """Parse 'bytes start-end/total' into (start, total); total is None when '*'."""
+    try:
+        unit, spec = value.split(' ', 1)
+        span, total = spec.split('/', 1)
+        start = int(span.split('-', 1)[0])
+        return start, (None if total == '*' else int(total))
+    except (AttributeError, ValueError):
+        return None, None
+
+def stream_resumable(http, url, headers, part_path, max_bytes, chunk_size=STREAM_CHUNK_SIZE, cancel=None,
+                     observe=None):
+    """
+    Stream a response body into a staging file, continuing from any bytes a
+    previous attempt already saved. The Range request carries If-Range with the
+    recorded ETag or Last-Modified, so a changed resource comes back whole and
+    replaces the stale bytes. observe(url, status, headers) is called with
+    the response. Returns the path of the complete body.
+    """
+    meta = load_partial_meta(part_path) or {}
+    offset = os.path.getsize(part_path) if meta and os.path.exists(part_path) else 0
+    if meta.get('length') is not None and offset == meta['length']:
+        return part_path
     
-    print(f"Attempting to download image for {actor_name} (Attempt {attempt}/{max_attempts})")
+    # Weak ETags cannot be used with If-Range; without a validator start over
+    etag = meta.get('etag')
+    validator = etag if etag and not etag.startswith('W/') else meta.get('last_modified')
+    request_headers = dict(headers)
+    if offset and validator:
+        request_headers['Range'] = f"bytes={offset}-"
+        request_headers['If-Range'] = validator
     
-    try:
-        # Using a more reliable method - Bing image search API
-        # For demo purposes, we're using a direct image URL from a reliable source
-        # In a real implementation, you would need to use a proper image API
+    with http.get(url, headers=request_headers, timeout=REQUEST_TIMEOUT, stream=True) as response:
+        if observe:
+            observe(url, response.status_code, response.headers)
+        response.raise_for_status()
         
-        # Simulate different image sources based on the attempt number
-        if attempt == 1:
-            # For first attempt, try an entertainment photo API-like approach
-            search_url = f"https://api.serphouse.com/serp/live?q={actor_name}+actor+portrait&gl=us"
-        elif attempt == 2:
-            # For second attempt, try a movie database API-like approach
-            search_url = f"https://api.themoviedb.org/3/search/person?api_key=YOUR_API_KEY&query={actor_name}"
+        if response.status_code == 206:
+            start, total = parse_content_range(response.headers.get('Content-Range'))
+            if start != offset or (total is not None and meta.get('length') not in (None, total)):
+                discard_partial(part_path)
+                raise IncompleteDownload(f"Server resumed {url} at an unexpected range")
+            mode = 'ab'
+            length = total if total is not None else meta.get('length')
         else:
-            # For third attempt, try a general image search API
-            search_url = f"https://api.unsplash.com/search/photos?query={actor_name}+portrait&client_id=YOUR_CLIENT_ID"
-        
-        # For demonstration, instead of actually using those APIs (which would require keys),
-        # we'll use placeholder image URLs that are guaranteed to work
-        placeholder_urls = [
-            "https://picsum.photos/800/1200",
-            "https://source.unsplash.com/random/800x1200/?portrait",
-            "https://baconmockup.com/800/1200"
-        ]
+            # Full body: either a fresh download or the resource changed
+            offset = 0
+            mode = 'wb'
+            declared = response.headers.get('Content-Length')
+            length = int(declared) if declared and declared.isdigit() else None
+            meta = dict(response_validators(response.headers), url=url, length=length)
+            with open(part_path + '.json', 'w') as f:
+                json.dump(meta, f)
         
-        img_url = placeholder_urls[attempt - 1]
+        if max_bytes and length and length > max_bytes:
+            discard_partial(part_path)
+            raise ImageTooLarge(f"Image is {length} bytes, limit is {max_bytes}")
         
-        # In a real application, you would use the API response to get the actual image URL
-        # response = requests.get(search_url, headers=headers, timeout=10)
-        # response.raise_for_status()
-        # Parse the JSON and extract the image URL
-        # img_url = response.json()['images'][0]['url']  # Example, would depend on API
-        
-        # Download the actual image
-        img_response = requests.get(img_url, headers=headers, timeout=10)
-        img_response.raise_for_status()
-        
-        # Try to open and convert the image
-        img = Image.open(BytesIO(img_response.content))
-        
-        # If the image has transparency (RGBA mode), keep it that way
-        if img.mode == 'RGBA':
-            return img
+        size = offset
+        with open(part_path, mode) as f:
+            for chunk in response.iter_content(chunk_size):
+                check_cancelled(cancel)
+                size += len(chunk)
+                if max_bytes and size > max_bytes:
+                    f.close()
+                    discard_partial(part_path)
+                    raise ImageTooLarge(f"Image exceeds the {max_bytes} byte limit")
+                f.write(chunk)
+    
+    if length is not None and size != length:
+        raise IncompleteDownload(f"Received {size} of {length} bytes from {url}")
+    return part_path
+
+def fetch_resumable(http, url, headers, part_path, max_bytes, cancel=None, observe=None):
+    """
+    Download into the staging file, resuming the same source right away if the
+    transfer is cut short after making progress. Returns an open file.
+    """
+    for resume in range(RESUME_ATTEMPTS + 1):
+        before = os.path.getsize(part_path) if os.path.exists(part_path) else 0
+        try:
+            return open(stream_resumable(http, url, headers, part_path, max_bytes, cancel=cancel, observe=observe),
+                        'rb')
+        except (requests.ConnectionError, requests.Timeout, requests.exceptions.ChunkedEncodingError,
+                IncompleteDownload) as e:
+            after = os.path.getsize(part_path) if os.path.exists(part_path) else 0
+            if resume == RESUME_ATTEMPTS or after <= before:
+                raise
+            print(f"Transfer from {url} interrupted at {after} bytes, resuming: {str(e)}")
+
+def fit_size(size, target_size):
+    """Largest size with the aspect ratio of size that fits target_size, never upscaled."""
+    scale = min(target_size[0] / size[0], target_size[1] / size[1], 1)
+    return max(1, round(size[0] * scale)), max(1, round(size[1] * scale))
+
+def decode_image(data, target_size=None, transpose=False):
+    """
+    Decode downloaded image bytes (or a file holding them) into a PIL image.
+    RGBA images keep their transparency, everything else is converted to RGB.
+    With a (width, height) target_size larger images are scaled down to fit;
+    JPEGs are then decoded at a reduced DCT scale, so decode time and memory
+    follow the target size rather than the source resolution. Pass
+    transpose=True when the EXIF orientation will be applied to the pixels
+    afterwards, so the target size is fitted to the image as displayed.
+    """
+    img = Image.open(BytesIO(data) if isinstance(data, bytes) else data)
+    
+    fitted = None
+    if transpose and target_size and img.getexif().get(ExifTags.Base.Orientation) in (5, 6, 7, 8):
+        # The image is stored rotated by 90 degrees and will be turned upright
+        target_size = (target_size[1], target_size[0])
+    if target_size and (img.width > target_size[0] or img.height > target_size[1]):
+        fitted = fit_size(img.size, target_size)
+        if img.format == 'JPEG':
+            # Decode at 1/2, 1/4 or 1/8 scale while keeping twice the final size,
+            # so the resize below still has enough pixels to stay sharp
+            img.draft('RGB', (fitted[0] * JPEG_DRAFT_GAP, fitted[1] * JPEG_DRAFT_GAP))
+    
+    # If the image has transparency (RGBA mode), keep it that way
+    if img.mode == 'RGBA':
+        img.load()
+    else:
         # Otherwise convert to RGB first to handle different color modes
         img = img.convert('RGB')
-        
-        return img
-            
+    if fitted:
+        img = img.resize(fitted, Image.Resampling.LANCZOS, reducing_gap=JPEG_DRAFT_GAP)
+    return img
+
+def strip_metadata(img, icc='keep'):
+    """
+    Apply the EXIF orientation to the pixels and drop the metadata that is
+    not needed to display the image: EXIF, XMP, text chunks, comments and the
+    like. With icc='strip' an embedded ICC profile is dropped as well, with
+    icc='srgb' the pixels are first converted from it to sRGB.
+    Of all that, Pillow's encoders only ever write the ICC profile from
+    img.info, so the bytes returned alongside the image are those of a
+    dropped profile; existing files are cleaned by strip_image_metadata.py.
+    """
+    ImageOps.exif_transpose(img, in_place=True)
+    removed = 0
+    profile = img.info.get('icc_profile')
+    img.info = {key: value for key, value in img.info.items() if key in KEPT_METADATA}
+    if profile and icc != 'keep':
+        if icc == 'srgb':
+            img = ImageCms.profileToProfile(img, ImageCms.ImageCmsProfile(BytesIO(profile)),
+                                            ImageCms.createProfile('sRGB'), outputMode=img.mode)
+        img.info.pop('icc_profile', None)
+        removed = len(profile)
+    return img, removed
+
+def save_image(img, output_path, blob_store=None, fsync='never'):
+    """
+    Save the image as PNG, creating the output directory if needed.
+    With a blob store the PNG is encoded into the store and output_path is
+    linked to it. Returns (digest, is_new) in that case, else (None, True).
+    The PNG is written to a temporary file and renamed into place once its
+    header has been checked, so output_path never holds a partial or
+    mislabelled file. fsync is a WritePolicy mode deciding whether the file
+    and its directory are flushed to disk before returning.
+    """
+    os.makedirs(os.path.dirname(output_path) or '.', exist_ok=True)
+    if blob_store is None:
+        with atomic_write(output_path, file_synced(fsync), dir_synced(fsync)) as tmp_path:
+            img.save(tmp_path, 'PNG')
+            check_format(tmp_path, 'PNG')
+        return None, True
+    tmp_path = blob_store.temp_path()
+    try:
+        img.save(tmp_path, 'PNG')
+        check_format(tmp_path, 'PNG')
+        if file_synced(fsync):
+            fsync_path(tmp_path)
+        digest, is_new = blob_store.add(tmp_path)
+    except Exception:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+    blob_store.link(digest, output_path)
+    if dir_synced(fsync):
+        fsync_path(os.path.dirname(blob_store.blob_path(digest)))
+        fsync_path(os.path.dirname(output_path) or '.')
+    return digest, is_new
+
+def variant_path(output_path, width):
+    """Where the variant of the given width of an actor image is stored."""
+    directory, name = os.path.split(output_path)
+    return os.path.join(directory, VARIANTS_DIR, str(width), name)
+
+def resize_ladder(img, widths):
+    """
+    Yield (width, image) for every width smaller than the image, largest
+    first. Each step is downsampled from the previous one, so the original is
+    decoded once and every resize works on an already reduced image.
+    """
+    current = img
+    for width in sorted(set(widths), reverse=True):
+        if width >= img.width:
+            continue
+        height = max(1, round(img.height * width / img.width))
+        current = current.resize((width, height), Image.Resampling.LANCZOS)
+        yield width, current
+
+def psnr(data, original):
+    """Peak signal-to-noise ratio in dB of encoded image data against the original pixels."""
+    with Image.open(BytesIO(data)) as decoded:
+        diff = ImageChops.difference(decoded.convert(original.mode), original)
+    mse = sum(ImageStat.Stat(diff).sum2) / (original.width * original.height * len(original.getbands()))
+    return float('inf') if mse == 0 else 10 * math.log10(255 ** 2 / mse)
+
+def encode_candidate(img, fmt, options):
+    buffer = BytesIO()
+    img.save(buffer, fmt, **options)
+    return buffer.getvalue()
+
+def encode_modern(img, png_path, formats, quality, min_psnr, fsync='never'):
+    """
+    Encode img in each of the given modern formats next to its PNG, trying
+    every candidate encoding in parallel. Per format the smallest candidate
+    that is lossless or reaches min_psnr is written, provided it beats the
+    PNG. Returns a list of (format, setting, bytes), with setting and bytes
+    None for formats where no candidate qualified.
+    """
+    candidates = []
+    for fmt in formats:
+        for setting, lossless, options in MODERN_ENCODINGS[fmt]:
+            if not lossless:
+                options = dict(options, quality=quality)
+                setting = f"{setting} q{quality}"
+            candidates.append((fmt, setting, lossless, options))
+    with ThreadPoolExecutor(max_workers=len(candidates)) as pool:
+        encoded = list(pool.map(lambda c: encode_candidate(img, c[0], c[3]), candidates))
+    
+    png_bytes = os.path.getsize(png_path)
+    best = {fmt: None for fmt in formats}
+    for (fmt, setting, lossless, _), data in zip(candidates, encoded):
+        if len(data) >= png_bytes or (best[fmt] and len(data) >= len(best[fmt][1])):
+            continue
+        if lossless or psnr(data, img) >= min_psnr:
+            best[fmt] = (setting, data)
+    
+    results = []
+    for fmt, choice in best.items():
+        if choice is None:
+            results.append((fmt, None, None))
+            continue
+        setting, data = choice
+        path = os.path.splitext(png_path)[0] + EXTENSIONS[fmt]
+        with atomic_write(path, file_synced(fsync), dir_synced(fsync)) as tmp_path:
+            with open(tmp_path, 'wb') as f:
+                f.write(data)
+            check_format(tmp_path, fmt)
+        results.append((fmt, setting, len(data)))
+    return results
+
+class ImageOutputs:
+    """
+    What is written for every stored image besides its PNG: resized
+    variants at the given widths and, for the original and every variant,
+    modern-format encodings. Plain data, so the encode pipeline can pass it
+    to its worker processes.
+    """
+
+    def __init__(self, widths=(), formats=(), quality=DEFAULT_QUALITY, min_psnr=DEFAULT_MIN_PSNR):
+        self.widths = list(widths)
+        self.formats = list(formats)
+        self.quality = quality
+        self.min_psnr = min_psnr
+
+    def __bool__(self):
+        return bool(self.widths or self.formats)
+
+    def missing(self, size, have_variants=(), have_encodings=()):
+        """Whether an image of the given size lacks any of its variants or encodings."""
+        levels = [size[0]] + [width for width in self.widths if width < size[0]]
+        return any(width not in have_variants for width in levels[1:]) \
+            or any((width, fmt) not in have_encodings for width in levels for fmt in self.formats)
+
+    def derive(self, img, output_path, have_variants=(), have_encodings=(), fsync='never'):
+        """
+        Write the variants and encodings of img that are not in the have_*
+        collections. Returns (variants, encodings) as lists of
+        (width, height, bytes) and (width, is_variant, format, setting, bytes).
+        """
+        variants, encodings = [], []
+        levels = [(img.width, False, output_path, img)]
+        for width, variant in resize_ladder(img, self.widths):
+            path = variant_path(output_path, width)
+            if width not in have_variants:
+                save_image(variant, path, fsync=fsync)
+                variants.append((width, variant.height, os.path.getsize(path)))
+            levels.append((width, True, path, variant))
+        for width, is_variant, path, level in levels:
+            formats = [fmt for fmt in self.formats if (width, fmt) not in have_encodings]
+            if formats:
+                encodings += [(width, is_variant) + result
+                              for result in encode_modern(level, path, formats, self.quality,
+                                                          self.min_psnr, fsync)]
+        return variants, encodings
+
+def encode_image(img, output_path, blob_store=None, outputs=None, fsync='never'):
+    """
+    Save the image and its derived outputs. Returns (digest, is_new,
+    variants, encodings) as save_image() and ImageOutputs.derive() do.
+    """
+    digest, is_new = save_image(img, output_path, blob_store, fsync)
+    variants, encodings = outputs.derive(img, output_path, fsync=fsync) if outputs else ([], [])
+    return digest, is_new, variants, encodings
+
+def written_directories(output_path, blob_store=None, digest=None, variants=(), encodings=()):
+    """Directories an encode_image() or derive() call renamed files into."""
+    directories = {os.path.dirname(output_path) or '.'}
+    widths = {width for width, _, _ in variants}
+    widths |= {width for width, is_variant, _, _, size in encodings if is_variant and size}
+    for width in widths:
+        # A newly created variant directory is an entry of its parent as well
+        variant_dir = os.path.dirname(variant_path(output_path, width))
+        directories |= {variant_dir, os.path.dirname(variant_dir)}
+    if blob_store and digest:
+        directories.add(os.path.dirname(blob_store.blob_path(digest)))
+    return directories
+
+def record_derived(manifest, actor_name, variants, encodings, missing=False):
+    """Record the variants and encodings of an image in the manifest, if there is one, and report them."""
+    if manifest:
+        manifest.record_variants(clean_name_for_file(actor_name), variants)
+        manifest.record_encodings(clean_name_for_file(actor_name), encodings)
+    kind = "missing " if missing else ""
+    parts = []
+    if variants:
+        parts.append(f"{len(variants)} {kind}size variants")
+    written = sum(1 for encoding in encodings if encoding[3])
+    if written:
+        parts.append(f"{written} {kind}WebP/AVIF files")
+    if parts:
+        print(f"Saved {' and '.join(parts)} for {actor_name}")
+
+def record_saved_image(manifest, output_path, actor_name, source, size, digest, is_new,
+                       variants=(), encodings=()):
+    """Record a saved image in the manifest, if there is one, and report it."""
+    if manifest:
+        duplicate_bytes = 0 if is_new else os.path.getsize(output_path)
+        manifest.record_image(clean_name_for_file(actor_name), output_path, actor_name, source,
+                              digest or file_digest(output_path), size, duplicate_bytes)
+    if not is_new:
+        print(f"Image for {actor_name} is identical to an existing blob, linked it.")
+    print(f"Successfully saved PNG image for {actor_name}")
+    record_derived(manifest, actor_name, variants, encodings)
+
+class EncodePipeline:
+    """
+    CPU stage of the download pipeline: decoded images are PNG-encoded and
+    saved by a process pool while the download threads move on to the next
+    image. At most queue_size images wait for an encoder; submit() blocks
+    beyond that, so the network stage cannot run ahead of the encoders and
+    pile decoded images up in memory. Results are recorded in the manifest
+    from the parent process as the encoders finish.
+    """
+
+    def __init__(self, workers, queue_size, blob_store=None, manifest=None, outputs=None, writes=None,
+                 journal=None):
+        self.blob_store = blob_store
+        self.manifest = manifest
+        self.journal = journal
+        self.outputs = outputs
+        self.writes = writes or WritePolicy()
+        self.failed = set()
+        self._slots = threading.BoundedSemaphore(queue_size)
+        self._lock = threading.Lock()
+        self.pool = ProcessPoolExecutor(max_workers=workers)
+        # Fork the workers now, before the download threads exist
+        self.pool.submit(int).result()
+
+    def submit(self, img, output_path, actor_name, source=None):
+        """Queue an image for encoding, waiting while the queue is full."""
+        self._slots.acquire()
+        try:
+            future = self.pool.submit(encode_image, img, output_path, self.blob_store, self.outputs,
+                                      self.writes.fsync)
+        except Exception:
+            self._slots.release()
+            raise
+        size = img.size
+        future.add_done_callback(lambda f: self._finished(f, output_path, actor_name, source, size))
+
+    def _finished(self, future, output_path, actor_name, source, size):
+        self._slots.release()
+        try:
+            digest, is_new, variants, encodings = future.result()
+            self.writes.saved(written_directories(output_path, self.blob_store, digest, variants, encodings))
+            record_saved_image(self.manifest, output_path, actor_name, source, size, digest, is_new,
+                               variants, encodings)
+        except Exception as e:
+            print(f"Error saving image for {actor_name}: {str(e)}")
+            with self._lock:
+                self.failed.add(actor_name)
+            if self.manifest:
+                self.manifest.record_failure(clean_name_for_file(actor_name), actor_name)
+            if self.journal:
+                self.journal.record(actor_name, 'retryable', e)
+
+    def close(self):
+        """Wait for the queued images and return the actors whose image could not be saved."""
+        self.pool.shutdown(wait=True)
+        self.writes.flush()
+        return self.failed
+
+def ensure_derived(output_path, actor_name, context):
+    """
+    Create the size variants and modern encodings an already stored image
+    is missing. Only the header is read unless something has to be made.
+    """
+    clean_name = clean_name_for_file(actor_name)
+    manifest = context.manifest
+    try:
+        have_variants = manifest.variant_widths(clean_name) if manifest else set()
+        have_encodings = manifest.encoded(clean_name) if manifest else set()
+        with Image.open(output_path) as img:
+            size = img.size
+        if not context.outputs.missing(size, have_variants, have_encodings):
+            return
+        variants, encodings = context.outputs.derive(decode_image(output_path), output_path,
+                                                     have_variants, have_encodings, context.writes.fsync)
+        context.writes.saved(written_directories(output_path, variants=variants, encodings=encodings))
+        if manifest:
+            manifest.record_size(clean_name, size)
+        record_derived(manifest, actor_name, variants, encodings, missing=True)
+    except Exception as e:
+        print(f"Error creating size variants or WebP/AVIF files for {actor_name}: {str(e)}")
+
+def store_image(img, output_path, actor_name, context=None, source=None):
+    """
+    Save a downloaded image as PNG, along with the context's derived outputs,
+    after stripping its metadata unless the context keeps it. Reports the
+    outcome, recording it in the context's manifest. With an encode pipeline
+    the image is only queued and failures are reported when the pipeline is
+    closed. Returns True on success.
+    """
+    try:
+        if context and context.strip_metadata:
+            img, removed = strip_metadata(img, context.icc)
+            context.stats.record_stripped(removed)
+        if context and context.encoder:
+            context.encoder.submit(img, output_path, actor_name, source)
+            return True
+        digest, is_new, variants, encodings = encode_image(img, output_path, context.blob_store if context else None,
+                                                           context.outputs if context else None,
+                                                           context.writes.fsync if context else 'never')
+        if context:
+            context.writes.saved(written_directories(output_path, context.blob_store, digest, variants, encodings))
+        record_saved_image(context.manifest if context else None, output_path, actor_name, source,
+                           img.size, digest, is_new, variants, encodings)
+        return True
     except Exception as e:
-        print(f"Error during download (Attempt {attempt}): {str(e)}")
+        print(f"Error saving image for {actor_name}: {str(e)}")
+        return False
+
+def fetch_image(actor_name, attempt=1, max_attempts=3, context=None, cancel=None):
+    """
+    Download an image of the actor from the source for the given attempt.
+    Returns the image object and raises on any failure so callers can decide
+    whether to retry. If a DownloadContext is given, its pooled session,
+    limits and source health are used. Setting the optional cancel event
+    abandons the download between chunks.
+    """
+    check_cancelled(cancel)
+    headers = build_headers()
+    
+    # Using a more reliable method - Bing image search API
+    # For demo purposes, we're using a direct image URL from a reliable source
+    # In a real implementation, you would need to use a proper image API
+    
+    # Simulate different image sources based on the attempt number
+    if attempt == 1:
+        # For first attempt, try an entertainment photo API-like approach
+        search_url = f"https://api.serphouse.com/serp/live?q={actor_name}+actor+portrait&gl=us"
+    elif attempt == 2:
+        # For second attempt, try a movie database API-like approach
+        search_url = f"https://api.themoviedb.org/3/search/person?api_key=YOUR_API_KEY&query={actor_name}"
+    else:
+        # For third attempt, try a general image search API
+        search_url = f"https://api.unsplash.com/search/photos?query={actor_name}+portrait&client_id=YOUR_CLIENT_ID"
+    
+    # For demonstration, instead of actually using those APIs (which would require keys),
+    # we'll use placeholder image URLs that are guaranteed to work
+    img_url = PLACEHOLDER_URLS[attempt - 1]
+    
+    # Do not spend a timeout on a source whose circuit is open
+    if context and not context.health.allow(img_url):
+        raise SourceUnavailable(f"Skipping {urlparse(img_url).netloc} for {actor_name}, its circuit is open")
+    
+    print(f"Attempting to download image for {actor_name} (Attempt {attempt}/{max_attempts})")
+    
+    # In a real application, you would use the API response to get the actual image URL
+    # response = requests.get(search_url, headers=headers, timeout=10)
+    # response.raise_for_status()
+    # Parse the JSON and extract the image URL
+    # img_url = response.json()['images'][0]['url']  # Example, would depend on API
+    
+    # Download the actual image
+    http = context.session if context else requests
+    started = time.monotonic()
+    try:
+        with context.request_slot(img_url) if context else nullcontext():
+            if context and context.staging_dir:
+                # Keep the body in the staging directory so interrupted transfers can resume
+                part_path = context.partial_path(clean_name_for_file(actor_name), img_url)
+                body = fetch_resumable(http, img_url, headers, part_path, context.max_bytes, cancel,
+                                       context.observe_response)
+                validators = load_partial_meta(part_path) or {}
+            elif context and context.stream:
+                # Spool the body to disk so memory stays bounded to one chunk
+                with http.get(img_url, headers=headers, timeout=REQUEST_TIMEOUT, stream=True) as img_response:
+                    context.observe_response(img_url, img_response.status_code, img_response.headers)
+                    img_response.raise_for_status()
+                    body = stream_to_file(img_response, context.max_bytes, cancel=cancel)
+                validators = response_validators(img_response.headers)
+            else:
+                # The body is only read once its declared size has been checked
+                with http.get(img_url, headers=headers, timeout=REQUEST_TIMEOUT, stream=True) as img_response:
+                    if context:
+                        context.observe_response(img_url, img_response.status_code, img_response.headers)
+                    img_response.raise_for_status()
+                    check_content_length(img_response.headers, context.max_bytes if context else DEFAULT_MAX_BYTES)
+                    body = img_response.content
+                validators = response_validators(img_response.headers)
         
+        # Try to open and convert the image
+        try:
+            img = decode_image(body, context.target_size if context else None,
+                               context.strip_metadata if context else False)
+        finally:
+            if not isinstance(body, bytes):
+                body.close()
+            if context and context.staging_dir:
+                # The staged body has been consumed, successfully or not
+                discard_partial(part_path)
+    
+    except DownloadCancelled:
+        if context:
+            context.health.abandon(img_url)
+        raise
+    except Exception as e:
+        if context:
+            context.health.record(img_url, e, time.monotonic() - started)
+        raise
+    
+    if context:
+        context.health.record(img_url, None, time.monotonic() - started)
+        if context.negative_cache:
+            context.negative_cache.clear(clean_name_for_file(actor_name), img_url)
+        if context.http_cache:
+            context.http_cache.store(clean_name_for_file(actor_name), img_url, validators)
+    return img
+
+def refresh_image(actor_name, output_path, context):
+    """
+    Revalidate an existing image against the source it was downloaded from.
+    Sends If-None-Match / If-Modified-Since from the HTTP cache: a 304 keeps
+    the stored file, a 200 replaces it. Without cached validators, or while
+    Cache-Control says the image is still fresh, no request is made.
+    The existing image is kept whenever the refresh fails.
+    """
+    clean_name = clean_name_for_file(actor_name)
+    img_url, entry = context.http_cache.find(clean_name, PLACEHOLDER_URLS)
+    if entry is None:
+        print(f"Image for {actor_name} already exists and has no cached validators, skipping.")
+        return True
+    if context.http_cache.is_fresh(entry):
+        print(f"Image for {actor_name} is still fresh, skipping.")
+        return True
+    
+    headers = build_headers()
+    headers.update(HttpCache.conditional_headers(entry))
+    try:
+        with context.request_slot(img_url):
+            with context.session.get(img_url, headers=headers, timeout=REQUEST_TIMEOUT, stream=True) as img_response:
+                context.observe_response(img_url, img_response.status_code, img_response.headers)
+                if img_response.status_code == 304:
+                    context.http_cache.store(clean_name, img_url, response_validators(img_response.headers))
+                    print(f"Image for {actor_name} is unchanged upstream.")
+                    return True
+                img_response.raise_for_status()
+                body = stream_to_file(img_response, context.max_bytes)
+        with body:
+            img = decode_image(body, context.target_size, context.strip_metadata)
+    except Exception as e:
+        print(f"Error refreshing image for {actor_name}, keeping the existing one: {str(e)}")
+        return True
+    
+    context.http_cache.store(clean_name, img_url, response_validators(img_response.headers))
+    print(f"Image for {actor_name} changed upstream, replacing it.")
+    # A failed save still leaves an image on disk, so the actor stays successful
+    store_image(img, output_path, actor_name, context, img_url)
+    return True
+
+def report_download_error(actor_name, attempt, error):
+    """Print why a download attempt produced no image."""
+    if isinstance(error, SourceUnavailable):
+        print(str(error))
+    elif isinstance(error, DownloadCancelled):
+        print(f"Cancelled attempt {attempt} for {actor_name}, another source answered first")
+    else:
+        print(f"Error during download (Attempt {attempt}): {str(error)}")
+
+def download_image(actor_name, attempt=1, max_attempts=3, context=None, cancel=None, errors=None):
+    """
+    Download an image of the actor using a more reliable API.
+    Returns the image object if successful, None otherwise; the error is
+    appended to the optional errors list. See fetch_image() for the context
+    and cancel arguments.
+    """
+    try:
+        return fetch_image(actor_name, attempt, max_attempts, context, cancel)
+    except Exception as e:
+        report_download_error(actor_name, attempt, e)
+        if context:
+            context.source_failed(actor_name, attempt, e)
+        if errors is not None:
+            errors.append(e)
     return None
 
-def process_actor(actor_name, output_dir):
+def download_image_hedged(actor_name, context, max_attempts=3, errors=None):
+    """
+    Race the image sources for one actor. The first source is requested
+    right away; whenever the hedge delay passes without a usable image (or a
+    source fails), the next source is started in parallel. The first valid
+    image wins and the requests still in flight are cancelled.
+    Returns (image, source URL), or (None, None) if every source failed.
+    """
+    cancel = threading.Event()
+    pending = {}
+    attempts = context.source_order(clean_name_for_file(actor_name))[:max_attempts]
+    img = source = None
+    try:
+        while img is None:
+            if attempts:
+                attempt = attempts.pop(0)
+                future = context.hedge_pool.submit(
+                    download_image, actor_name, attempt, max_attempts, context, cancel, errors)
+                pending[future] = PLACEHOLDER_URLS[attempt - 1]
+                delay = context.hedge_delay_for(pending[future])
+            elif pending:
+                delay = None
+            else:
+                break
+            done, _ = wait(pending, timeout=delay, return_when=FIRST_COMPLETED)
+            for future in done:
+                url = pending.pop(future)
+                if img is None and future.result() is not None:
+                    img, source = future.result(), url
+    finally:
+        cancel.set()
+        for future in pending:
+            future.cancel()
+    return img, source
+
+def record_success(context, actor_name):
+    """Journal that an actor's image was stored, if there is a journal."""
+    if context and context.journal:
+        context.journal.record(actor_name, 'success')
+
+def record_failure(context, actor_name, errors=(), downloaded=False):
+    """
+    Mark an actor whose image could not be stored in the manifest and the
+    journal, if there are any. The failure is fatal only when no source
+    produced an image (downloaded) and none failed for a reason that may go
+    away; hedged requests cancelled because another source won do not count.
+    """
+    if context and context.manifest:
+        context.manifest.record_failure(clean_name_for_file(actor_name), actor_name)
+    if context and context.journal:
+        errors = [error for error in errors if not isinstance(error, DownloadCancelled)]
+        transient = downloaded or not errors or any(is_transient_failure(error) for error in errors)
+        context.journal.record(actor_name, 'retryable' if transient else 'fatal', errors[-1] if errors else None)
+
+def process_actor(actor_name, output_dir, context=None):
     """
     Process a single actor: check if image exists, download if needed,
     convert to PNG, and save.
@@ -93,84 +2279,614 @@ def process_actor(actor_name, output_dir):
     clean_name = clean_name_for_file(actor_name)
     output_path = os.path.join(output_dir, f"{clean_name}.png")
     
-    # Check if the image already exists
-    if os.path.exists(output_path):
+    # Check if the image already exists; the manifest answers without touching the disk
+    if context and context.manifest:
+        exists = context.manifest.is_done(clean_name)
+    else:
+        exists = os.path.exists(output_path)
+    if exists:
+        if context and context.outputs:
+            ensure_derived(output_path, actor_name, context)
+        if context and context.refresh:
+            return refresh_image(actor_name, output_path, context)
         print(f"Image for {actor_name} already exists, skipping.")
         return True
     
-    # Try up to 3 times to download and convert the image
-    for attempt in range(1, 4):
-        img = download_image(actor_name, attempt)
-        
-        if img:
+    # Sources that failed for this actor on recent runs are not asked again yet
+    attempts = context.source_order(clean_name) if context else range(1, 4)
+    if not attempts:
+        print(f"Every source failed recently for {actor_name}, skipping until the negative cache expires.")
+        return False
+    
+    errors = []
+    # Set once a source produced an image that could not be saved (a full disk, say)
+    downloaded = False
+    if context and context.hedge:
+        # All sources are raced inside one hedged call
+        img, source = download_image_hedged(actor_name, context, errors=errors)
+        if img and store_image(img, output_path, actor_name, context, source):
+            record_success(context, actor_name)
+            return True
+        print(f"Failed to download a valid image for {actor_name} from any source.")
+        record_failure(context, actor_name, errors, downloaded=img is not None)
+        return False
+    
+    # Try each of the 3 sources to download and convert the image, healthiest first;
+    # transient failures are retried against the same source per the retry policy
+    policy = context.retry_policy if context else None
+    for attempt in attempts:
+        retries = 0
+        while True:
+            if policy:
+                policy.record_request()
             try:
-                # Ensure the output directory exists
-                os.makedirs(output_dir, exist_ok=True)
-                
-                # Save as PNG
-                img.save(output_path, 'PNG')
-                print(f"Successfully saved PNG image for {actor_name}")
-                return True
+                img = fetch_image(actor_name, attempt, context=context)
             except Exception as e:
-                print(f"Error saving image for {actor_name}: {str(e)}")
+                report_download_error(actor_name, attempt, e)
+                errors.append(e)
+                if policy and policy.should_retry(e, retries):
+                    delay = policy.backoff(retries)
+                    print(f"Retrying attempt {attempt} for {actor_name} in {delay:.2f}s")
+                    time.sleep(delay)
+                    retries += 1
+                    continue
+                if context:
+                    context.source_failed(actor_name, attempt, e)
+                break
+            
+            downloaded = True
+            if store_image(img, output_path, actor_name, context, PLACEHOLDER_URLS[attempt - 1]):
+                record_success(context, actor_name)
+                return True
+            break
+    
+    print(f"Failed to download a valid image for {actor_name} after 3 attempts.")
+    record_failure(context, actor_name, errors, downloaded)
+    return False
+
+async def async_fetch_image(actor_name, attempt=1, max_attempts=3, context=None, executor=None):
+    """
+    Asyncio counterpart of fetch_image(). The context carries the shared
+    aiohttp session and limits. The CPU-bound decode runs on the executor so
+    the event loop keeps driving other requests. Raises on any failure.
+    """
+    headers = build_headers()
+    img_url = PLACEHOLDER_URLS[attempt - 1]
+    
+    if not context.health.allow(img_url):
+        raise SourceUnavailable(f"Skipping {urlparse(img_url).netloc} for {actor_name}, its circuit is open")
+    
+    print(f"Attempting to download image for {actor_name} (Attempt {attempt}/{max_attempts})")
+    
+    started = time.monotonic()
+    try:
+        async with context.async_request_slot(img_url):
+            async with context.session.get(img_url, headers=headers) as img_response:
+                context.observe_response(img_url, img_response.status, img_response.headers)
+                img_response.raise_for_status()
+                check_content_length(img_response.headers, context.max_bytes)
+                if context.stream:
+                    body = tempfile.TemporaryFile()
+                    size = 0
+                    async for chunk in img_response.content.iter_chunked(STREAM_CHUNK_SIZE):
+                        size += len(chunk)
+                        if context.max_bytes and size > context.max_bytes:
+                            body.close()
+                            raise ImageTooLarge(f"Image exceeds the {context.max_bytes} byte limit")
+                        body.write(chunk)
+                    body.seek(0)
+                else:
+                    body = await img_response.read()
         
-        # Minimal delay between attempts
-        if attempt < 3:
-            time.sleep(0.5)
+        loop = asyncio.get_running_loop()
+        try:
+            img = await loop.run_in_executor(executor, decode_image, body, context.target_size,
+                                             context.strip_metadata)
+        finally:
+            if not isinstance(body, bytes):
+                body.close()
+    
+    except asyncio.CancelledError:
+        # A hedged sibling won; the source gets neither credit nor blame
+        context.health.abandon(img_url)
+        raise
+    except Exception as e:
+        context.health.record(img_url, e, time.monotonic() - started)
+        raise
+    
+    context.health.record(img_url, None, time.monotonic() - started)
+    if context.negative_cache:
+        context.negative_cache.clear(clean_name_for_file(actor_name), img_url)
+    if context.http_cache:
+        context.http_cache.store(clean_name_for_file(actor_name), img_url, response_validators(img_response.headers))
+    return img
+
+async def async_download_image(actor_name, attempt=1, max_attempts=3, context=None, executor=None, errors=None):
+    """
+    Asyncio counterpart of download_image(). Returns the image object or None.
+    """
+    try:
+        return await async_fetch_image(actor_name, attempt, max_attempts, context, executor)
+    except Exception as e:
+        report_download_error(actor_name, attempt, e)
+        if context:
+            context.source_failed(actor_name, attempt, e)
+        if errors is not None:
+            errors.append(e)
+    return None
+
+async def async_download_image_hedged(actor_name, context, executor=None, max_attempts=3, errors=None):
+    """
+    Asyncio counterpart of download_image_hedged(); losing sources are
+    cancelled as tasks. Returns (image, source URL) or (None, None).
+    """
+    tasks = {}
+    attempts = context.source_order(clean_name_for_file(actor_name))[:max_attempts]
+    img = source = None
+    try:
+        while img is None:
+            if attempts:
+                attempt = attempts.pop(0)
+                task = asyncio.create_task(
+                    async_download_image(actor_name, attempt, max_attempts, context, executor, errors))
+                tasks[task] = PLACEHOLDER_URLS[attempt - 1]
+                delay = context.hedge_delay_for(tasks[task])
+            elif tasks:
+                delay = None
+            else:
+                break
+            done, _ = await asyncio.wait(tasks, timeout=delay, return_when=FIRST_COMPLETED)
+            for task in done:
+                url = tasks.pop(task)
+                if img is None and task.result() is not None:
+                    img, source = task.result(), url
+    finally:
+        for task in tasks:
+            task.cancel()
+    return img, source
+
+async def async_store_image(img, output_path, actor_name, context, executor=None, source=None):
+    """Run store_image() on the executor so PNG encoding stays off the event loop."""
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(executor, store_image, img, output_path, actor_name, context, source)
+
+async def async_process_actor(actor_name, output_dir, context, executor=None):
+    """
+    Asyncio counterpart of process_actor(). PNG encoding is offloaded to
+    the executor as well.
+    """
+    clean_name = clean_name_for_file(actor_name)
+    output_path = os.path.join(output_dir, f"{clean_name}.png")
+    
+    if context.manifest.is_done(clean_name) if context.manifest else os.path.exists(output_path):
+        if context.outputs:
+            await asyncio.get_running_loop().run_in_executor(
+                executor, ensure_derived, output_path, actor_name, context)
+        print(f"Image for {actor_name} already exists, skipping.")
+        return True
+    
+    attempts = context.source_order(clean_name)
+    if not attempts:
+        print(f"Every source failed recently for {actor_name}, skipping until the negative cache expires.")
+        return False
+    
+    errors = []
+    downloaded = False
+    if context.hedge:
+        img, source = await async_download_image_hedged(actor_name, context, executor, errors=errors)
+        if img and await async_store_image(img, output_path, actor_name, context, executor, source):
+            record_success(context, actor_name)
+            return True
+        print(f"Failed to download a valid image for {actor_name} from any source.")
+        record_failure(context, actor_name, errors, downloaded=img is not None)
+        return False
+    
+    policy = context.retry_policy
+    for attempt in attempts:
+        retries = 0
+        while True:
+            policy.record_request()
+            try:
+                img = await async_fetch_image(actor_name, attempt, context=context, executor=executor)
+            except Exception as e:
+                report_download_error(actor_name, attempt, e)
+                errors.append(e)
+                if policy.should_retry(e, retries):
+                    delay = policy.backoff(retries)
+                    print(f"Retrying attempt {attempt} for {actor_name} in {delay:.2f}s")
+                    await asyncio.sleep(delay)
+                    retries += 1
+                    continue
+                context.source_failed(actor_name, attempt, e)
+                break
+            
+            downloaded = True
+            if await async_store_image(img, output_path, actor_name, context, executor,
+                                       PLACEHOLDER_URLS[attempt - 1]):
+                record_success(context, actor_name)
+                return True
+            break
     
     print(f"Failed to download a valid image for {actor_name} after 3 attempts.")
+    record_failure(context, actor_name, errors, downloaded)
     return False
 
-def main():
-    actors = [
-        "Johnny Depp", "Jennifer Lawrence", "Bradley Cooper", "Charlize Theron",
-        "Ryan Reynolds", "Anne Hathaway", "Benedict Cumberbatch", "Emma Stone",
-        "Matt Damon", "Chris Pratt", "Cate Blanchett", "Julia Roberts",
-        "Jake Gyllenhaal", "Gal Gadot", "Dwayne Johnson", "Zac Efron",
-        "Ryan Gosling", "Rooney Mara", "Keira Knightley", "John Cena",
-        "Susan Sarandon", "Michael B. Jordan", "Salma Hayek", "Zoe Saldana",
-        "Sandra Oh", "Channing Tatum", "John Boyega", "Tracee Ellis Ross"
-    ]
+async def run_async(actors, output_dir, concurrency, per_host, **context_options):
+    """
+    Process actors on a single event loop with up to `concurrency` actors
+    in flight. Extra keyword arguments are passed on to DownloadContext.
+    Returns the list of actors whose images were saved successfully.
+    """
+    connector = aiohttp.TCPConnector(limit=concurrency, limit_per_host=per_host)
+    timeout = aiohttp.ClientTimeout(total=REQUEST_TIMEOUT)
+    semaphore = asyncio.Semaphore(concurrency)
+    successful = []
+    
+    async def bounded(actor, context, executor):
+        async with semaphore:
+            try:
+                if await async_process_actor(actor, output_dir, context, executor):
+                    successful.append(actor)
+            except Exception as e:
+                print(f"Unexpected error while processing {actor}: {str(e)}")
+    
+    # Pillow releases the GIL while decoding and encoding, so a small thread pool
+    # is enough to keep the CPU-bound work off the event loop
+    with ThreadPoolExecutor(max_workers=os.cpu_count() or 4) as executor:
+        async with aiohttp.ClientSession(connector=connector, timeout=timeout) as session:
+            context = DownloadContext(per_host, session=session, **context_options)
+            await asyncio.gather(*(bounded(actor, context, executor) for actor in actors))
+            if context.encoder:
+                # Queued images are only saved once the encoders have finished with them
+                failed = await asyncio.get_running_loop().run_in_executor(executor, context.encoder.close)
+                successful = [actor for actor in successful if actor not in failed]
+            context.writes.flush()
+            if context.http_cache:
+                context.http_cache.save()
+            if context.stats.hosts:
+                context.report()
+    
+    return successful
+
+def run_concurrent(actors, output_dir, workers, context):
+    """
+    Process actors on a pool of worker threads sharing one DownloadContext.
+    Returns the list of actors whose images were saved successfully.
+    """
+    successful = []
+    
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        futures = {
+            executor.submit(process_actor, actor, output_dir, context): actor
+            for actor in actors
+        }
+        for future in as_completed(futures):
+            actor = futures[future]
+            try:
+                if future.result():
+                    successful.append(actor)
+            except Exception as e:
+                print(f"Unexpected error while processing {actor}: {str(e)}")
+    
+    return successful
+
+def parse_widths(value):
+    """argparse type for a comma-separated list of pixel widths."""
+    try:
+        widths = sorted({int(width) for width in value.split(',') if width.strip()})
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"invalid width list: {value!r}")
+    if not widths or widths[0] < 1:
+        raise argparse.ArgumentTypeError("widths must be positive integers")
+    return widths
+
+def parse_size(value):
+    """argparse type for a WIDTHxHEIGHT pixel size."""
+    try:
+        width, height = (int(part) for part in value.lower().split('x'))
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"invalid size: {value!r}, expected WIDTHxHEIGHT")
+    if width < 1 or height < 1:
+        raise argparse.ArgumentTypeError("sizes must be positive")
+    return width, height
+
+def parse_shard(value):
+    """argparse type for a shard spec INDEX/COUNT, with INDEX counted from 0."""
+    try:
+        index, count = (int(part) for part in value.split('/'))
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"invalid shard: {value!r}, expected INDEX/COUNT")
+    if count < 1 or not 0 <= index < count:
+        raise argparse.ArgumentTypeError("the shard index must be between 0 and COUNT - 1")
+    return index, count
+
+def parse_formats(value):
+    """
+    argparse type for a comma-separated list of modern formats. Formats
+    this Pillow build cannot write are dropped with a warning.
+    """
+    formats = []
+    Image.init()
+    for name in value.upper().split(','):
+        name = name.strip()
+        if name not in MODERN_ENCODINGS:
+            raise argparse.ArgumentTypeError(f"unsupported format: {name.lower()!r}")
+        if name not in Image.SAVE:
+            print(f"Pillow cannot write {name} here, skipping it.")
+        elif name not in formats:
+            formats.append(name)
+    return formats
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Download actor images and build CDN links.")
+    parser.add_argument("--workers", type=int, default=1,
+                        help="Number of actors processed in parallel (default: 1, sequential)")
+    parser.add_argument("--per-host", type=int, default=4,
+                        help="Maximum concurrent requests (and pooled connections) per image host (default: 4)")
+    parser.add_argument("--async", dest="use_async", action="store_true",
+                        help="Use the asyncio pipeline (requires aiohttp); --workers sets the number of actors in flight")
+    parser.add_argument("--stream", action="store_true",
+                        help="Stream image bodies to a temporary file instead of buffering them in memory")
+    parser.add_argument("--max-bytes", type=int, default=DEFAULT_MAX_BYTES,
+                        help="Reject image bodies larger than this many bytes; checked against Content-Length, "
+                             f"and while reading the body with --stream (default: {DEFAULT_MAX_BYTES})")
+    parser.add_argument("--resume", action="store_true",
+                        help="Keep partial bodies in the state directory and resume them with Range requests (implies --stream)")
+    parser.add_argument("--rate", type=float, default=DEFAULT_RATE,
+                        help=f"Requests per second allowed to each image host (default: {DEFAULT_RATE})")
+    parser.add_argument("--burst", type=int, default=DEFAULT_BURST,
+                        help=f"Requests a host may receive in a burst before --rate applies (default: {DEFAULT_BURST})")
+    parser.add_argument("--adaptive", action="store_true",
+                        help="Adapt per-host concurrency (AIMD) to latency and errors, starting from --per-host")
+    parser.add_argument("--max-per-host", type=int, default=DEFAULT_MAX_PER_HOST,
+                        help=f"Upper bound for adaptive per-host concurrency (default: {DEFAULT_MAX_PER_HOST})")
+    parser.add_argument("--target-latency", type=float, default=DEFAULT_TARGET_LATENCY,
+                        help=f"p95 latency in seconds below which adaptive concurrency grows (default: {DEFAULT_TARGET_LATENCY})")
+    parser.add_argument("--hedge", action="store_true",
+                        help="Race the image sources: start the next one when the current one is slow")
+    parser.add_argument("--hedge-delay", type=float, default=None,
+                        help="Seconds to wait before hedging (default: observed p90 latency of the slow source)")
+    parser.add_argument("--breaker-threshold", type=int, default=DEFAULT_BREAKER_THRESHOLD,
+                        help=f"Consecutive failures before a source's circuit opens (default: {DEFAULT_BREAKER_THRESHOLD})")
+    parser.add_argument("--breaker-cooldown", type=float, default=DEFAULT_BREAKER_COOLDOWN,
+                        help=f"Seconds an open circuit waits before a probe request (default: {DEFAULT_BREAKER_COOLDOWN})")
+    parser.add_argument("--max-retries", type=int, default=DEFAULT_MAX_RETRIES,
+                        help=f"Retries of the same source after a transient failure (default: {DEFAULT_MAX_RETRIES})")
+    parser.add_argument("--retry-base-delay", type=float, default=DEFAULT_RETRY_BASE_DELAY,
+                        help=f"Base delay in seconds for exponential backoff (default: {DEFAULT_RETRY_BASE_DELAY})")
+    parser.add_argument("--retry-budget", type=float, default=DEFAULT_RETRY_BUDGET,
+                        help=f"Retries allowed as a fraction of all requests (default: {DEFAULT_RETRY_BUDGET})")
+    parser.add_argument("--rescan", action="store_true",
+                        help="Re-index the image directory even if it looks unchanged since the last run, "
+                             "e.g. after images were edited in place")
+    parser.add_argument("--refresh", action="store_true",
+                        help="Revalidate existing images with conditional requests instead of skipping them")
+    parser.add_argument("--dedupe", action="store_true",
+                        help="Store images once per content hash in the state directory and link actor files to them")
+    parser.add_argument("--encode-workers", type=int, default=0,
+                        help="Encode and save PNGs on this many processes while downloads continue (default: encode inline)")
+    parser.add_argument("--encode-queue", type=int, default=None,
+                        help="Decoded images that may wait for an encoder (default: twice --encode-workers)")
+    parser.add_argument("--target-size", type=parse_size, default=None,
+                        help="Scale downloaded images down to fit WIDTHxHEIGHT while decoding; "
+                             "JPEGs are decoded at reduced scale (default: keep the source size)")
+    parser.add_argument("--keep-metadata", action="store_true",
+                        help="Save images as decoded: no EXIF orientation fix and no --icc policy")
+    parser.add_argument("--icc", choices=ICC_POLICIES, default="keep",
+                        help="Embedded ICC profiles: keep them, strip them, or convert the pixels to sRGB "
+                             "and drop them (default: keep)")
+    parser.add_argument("--variants", type=parse_widths, nargs="?", const=DEFAULT_VARIANT_WIDTHS, default=[],
+                        help="Save resized variants at these comma-separated widths "
+                             f"(default when given without a value: {','.join(map(str, DEFAULT_VARIANT_WIDTHS))})")
+    parser.add_argument("--formats", type=parse_formats, default=[],
+                        help="Also save these modern formats next to every PNG, comma-separated: webp, avif")
+    parser.add_argument("--quality", type=int, default=DEFAULT_QUALITY,
+                        help=f"Quality setting for lossy WebP/AVIF encodings (default: {DEFAULT_QUALITY})")
+    parser.add_argument("--min-psnr", type=float, default=DEFAULT_MIN_PSNR,
+                        help=f"Lowest PSNR in dB a lossy encoding may have to be kept (default: {DEFAULT_MIN_PSNR})")
+    parser.add_argument("--fsync", choices=FSYNC_POLICIES, default="batch",
+                        help="How saved images are flushed to disk: always (every file and its directory), "
+                             f"batch (every file, and its directory once every {FSYNC_BATCH_SIZE} images) "
+                             "or never (default: batch)")
+    parser.add_argument("--retry-failed", action="store_true",
+                        help="Also attempt actors the journal marks as dead or still waiting to be retried, "
+                             "and sources the negative cache is holding back")
+    parser.add_argument("--negative-ttl", type=float, default=NEGATIVE_TTL,
+                        help="Seconds a source that failed for an actor is skipped for that actor, doubling "
+                             f"per consecutive failure (default: {NEGATIVE_TTL:.0f}, 0 disables the negative cache)")
+    parser.add_argument("--roster", default=None,
+                        help="File listing the actors to process, one name per line (default: the built-in list)")
+    parser.add_argument("--shard", type=parse_shard, default=None,
+                        help=f"Download only the actors of shard INDEX/COUNT of the roster (INDEX from 0) "
+                             f"that are not in actors_images yet, working in {SHARDS_DIR}/INDEX-of-COUNT; "
+                             "combine the shards with merge_shards.py")
+    parser.add_argument("--state-dir", default=None,
+                        help=f"Directory for local download state (default: {DEFAULT_STATE_DIR}; "
+                             "a shard always keeps its state in its own directory)")
+    args = parser.parse_args(argv)
+    if args.shard and args.state_dir:
+        parser.error("--state-dir cannot be combined with --shard, merge_shards.py reads the shard state "
+                     "from the shard directory")
+    if args.use_async and aiohttp is None:
+        parser.error("--async requires the aiohttp package")
+    if args.use_async and args.resume:
+        parser.error("--resume is only supported by the threaded downloader")
+    if args.use_async and args.adaptive:
+        parser.error("--adaptive is only supported by the threaded downloader")
+    if args.use_async and args.refresh:
+        parser.error("--refresh is only supported by the threaded downloader")
+    if args.workers < 1 or args.per_host < 1:
+        parser.error("--workers and --per-host must be at least 1")
+    if args.rate <= 0 or args.burst < 1:
+        parser.error("--rate must be positive and --burst at least 1")
+    if args.max_bytes <= 0:
+        parser.error("--max-bytes must be positive")
+    if args.negative_ttl < 0:
+        parser.error("--negative-ttl must not be negative")
+    if not 1 <= args.quality <= 100:
+        parser.error("--quality must be between 1 and 100")
+    if args.encode_workers < 0 or (args.encode_queue is not None and args.encode_queue < 1):
+        parser.error("--encode-workers must not be negative and --encode-queue must be at least 1")
+    return args
+
+def main(argv=None):
+    args = parse_args(argv)
+    
+    actors = load_roster(args.roster) if args.roster else list(ACTORS)
+    
+    # A shard keeps only the actors whose slug hashes into it and works in its
+    # own directory; merge_shards.py combines the shards afterwards
+    work_dir = ""
+    if args.shard:
+        index, count = args.shard
+        actors = [actor for actor in actors if shard_of(clean_name_for_file(actor), count) == index]
+        # Images already in the main tree are never downloaded again by a shard
+        existing = stored_slugs("actors_images")
+        stored = [actor for actor in actors if clean_name_for_file(actor) in existing]
+        actors = [actor for actor in actors if clean_name_for_file(actor) not in existing]
+        work_dir = shard_dir(index, count)
+        print(f"Shard {index}/{count}: {len(actors)} actors to download ({len(stored)} already in actors_images), "
+              f"working in {work_dir}")
+    state_dir = args.state_dir or os.path.join(work_dir, DEFAULT_STATE_DIR)
     
     # Set the output directory - FIXED to match the required folder name
-    output_dir = "actors_images"
+    output_dir = os.path.join(work_dir, "actors_images")
     
     # Ensure output directory exists
     os.makedirs(output_dir, exist_ok=True)
     
+    # Temporary files of killed runs are never renamed into place; clear them out
+    swept = sum(sweep_temp_files(root) for root in (output_dir, state_dir) if os.path.isdir(root))
+    if swept:
+        print(f"Removed {swept} stale temporary files.")
+    writes = WritePolicy(args.fsync)
+    
+    # The asset manifest records every stored image, so the existing ones are
+    # found with a single query instead of one filesystem probe per actor. The
+    # directory is only scanned again once files were added, removed or renamed
+    # since the last run, which is when its mtime changes.
+    manifest = AssetManifest(os.path.join(state_dir, "assets.sqlite"))
+    synced = manifest.sync_directory(output_dir, force=args.rescan)
+    if synced:
+        indexed, missing = synced
+        print(f"Indexed {indexed} images from {output_dir} into the asset manifest.")
+        if missing:
+            print(f"{missing} recorded images are missing from {output_dir} and will be downloaded again.")
+    
     # Track which actors already have images
-    successful_actors = []
+    done_slugs = manifest.done_slugs()
+    successful_actors = set()
     
     # First check which actors already have images
     for actor in actors:
-        clean_name = clean_name_for_file(actor)
-        if os.path.exists(os.path.join(output_dir, f"{clean_name}.png")):
+        if clean_name_for_file(actor) in done_slugs:
             print(f"Image for {actor} already exists, no need to download.")
-            successful_actors.append(actor)
+            successful_actors.add(actor)
     
     # Process only actors without existing images
     remaining_actors = [actor for actor in actors if actor not in successful_actors]
     print(f"Found {len(successful_actors)} existing images. Need to download {len(remaining_actors)} more.")
+    outputs = ImageOutputs(args.variants, args.formats, args.quality, args.min_psnr)
+    if args.refresh or outputs:
+        # Existing images are revalidated as well, or get the size variants
+        # and WebP/AVIF files they are still missing
+        remaining_actors = list(actors)
     
-    # Process each remaining actor
-    for actor in remaining_actors:
-        print(f"\nProcessing: {actor}")
-        success = process_actor(actor, output_dir)
-        
-        if success:
-            successful_actors.append(actor)
-        
-        # Add a very small delay between actors to avoid API rate limits
-        time.sleep(0.2)
+    # Outcomes of earlier runs are replayed from the journal, so actors that
+    # failed permanently or are still backing off are not attempted again
+    journal = RunJournal(os.path.join(state_dir, "journal.jsonl"), fsync=writes.per_file)
+    if not args.retry_failed:
+        states = {actor: journal.state(actor) for actor in remaining_actors}
+        dead = [actor for actor in remaining_actors if states[actor] == 'dead']
+        waiting = [actor for actor in remaining_actors if states[actor] == 'waiting']
+        if dead or waiting:
+            print(f"Skipping {len(dead)} actors that failed permanently and {len(waiting)} "
+                  f"waiting to be retried (use --retry-failed to attempt them).")
+            remaining_actors = [actor for actor in remaining_actors if states[actor] is None]
     
-    # Create the text file with CDN links
-    txt_path = "actor_image_links.txt"
-    with open(txt_path, 'w') as f:
-        for actor in actors:  # Generate links for ALL actors
-            cdn_link = create_cdn_link(actor)
-            # Only write links for successfully downloaded images
-            if actor in successful_actors:
-                f.write(f"{cdn_link}\n")
+    # Per actor and source failures, so chronic failures are not retried on every run
+    negative_cache = None
+    if args.negative_ttl:
+        negative_cache = NegativeCache(os.path.join(state_dir, "negative_cache.json"),
+                                       args.negative_ttl, enforce=not args.retry_failed)
+    
+    blob_store = None
+    if args.dedupe:
+        # Existing images join the content-addressed store before anything new is saved
+        blob_store = BlobStore(os.path.join(state_dir, "blobs"))
+        adopt_existing_images(output_dir, blob_store, manifest)
+    
+    encoder = None
+    if args.encode_workers:
+        # PNG encoding runs on its own processes, fed through a bounded queue
+        encoder = EncodePipeline(args.encode_workers, args.encode_queue or 2 * args.encode_workers,
+                                 blob_store, manifest, outputs, writes, journal)
+    
+    # Requests to each host are paced by a shared token bucket instead of fixed sleeps
+    rate_limiter = RateLimiter(args.rate, args.burst)
+    # Dead sources are skipped by their circuit breakers and healthy ones tried first
+    health = SourceHealth(args.breaker_threshold, args.breaker_cooldown)
+    retry_policy = RetryPolicy(args.max_retries, args.retry_base_delay, budget_ratio=args.retry_budget)
+    # Validators of every download, so later runs can revalidate with --refresh
+    http_cache = HttpCache(os.path.join(state_dir, "http_cache.json"))
+    
+    if args.use_async:
+        # Drive all downloads from a single event loop
+        print(f"Downloading with asyncio ({args.workers} in flight, {args.per_host} per host).")
+        successful_actors.update(
+            asyncio.run(run_async(remaining_actors, output_dir, args.workers, args.per_host,
+                                  stream=args.stream, max_bytes=args.max_bytes,
+                                  rate_limiter=rate_limiter, hedge=args.hedge,
+                                  hedge_delay=args.hedge_delay, health=health,
+                                  retry_policy=retry_policy, blob_store=blob_store,
+                                  manifest=manifest, encoder=encoder, outputs=outputs,
+                                  target_size=args.target_size, strip_metadata=not args.keep_metadata,
+                                  icc=args.icc, writes=writes, journal=journal,
+                                  negative_cache=negative_cache, http_cache=http_cache)))
+    else:
+        # One pooled session is reused for every actor and attempt
+        staging_dir = os.path.join(state_dir, "partial") if args.resume else None
+        host_limiter = HostLimiter(args.per_host, adaptive=args.adaptive,
+                                   max_per_host=args.max_per_host, target_latency=args.target_latency)
+        context = DownloadContext(args.per_host, stream=args.stream or args.resume,
+                                  max_bytes=args.max_bytes, staging_dir=staging_dir,
+                                  rate_limiter=rate_limiter, host_limiter=host_limiter,
+                                  hedge=args.hedge, hedge_delay=args.hedge_delay,
+                                  hedge_workers=args.workers * len(PLACEHOLDER_URLS), health=health,
+                                  retry_policy=retry_policy, refresh=args.refresh,
+                                  http_cache=http_cache,
+                                  blob_store=blob_store, manifest=manifest, encoder=encoder,
+                                  outputs=outputs, target_size=args.target_size,
+                                  strip_metadata=not args.keep_metadata, icc=args.icc, writes=writes,
+                                  journal=journal, negative_cache=negative_cache)
+        try:
+            if args.workers > 1:
+                # Run downloads in parallel, bounded by the worker count and per-host caps
+                print(f"Downloading with {args.workers} workers ({args.per_host} per host).")
+                successful_actors.update(run_concurrent(remaining_actors, output_dir, args.workers, context))
+            else:
+                # Process each remaining actor
+                for actor in remaining_actors:
+                    print(f"\nProcessing: {actor}")
+                    success = process_actor(actor, output_dir, context)
+                    
+                    if success:
+                        successful_actors.add(actor)
+            if encoder:
+                # Queued images are only saved once the encoders have finished with them
+                successful_actors -= encoder.close()
+            if context.stats.hosts:
+                context.report()
+        finally:
+            context.close()
+    txt_path = write_link_files(actors, successful_actors, manifest, work_dir,
+                                variants=bool(args.variants), formats=bool(args.formats))
+    # Every image this run saved is already in the manifest
+    manifest.mark_synced(output_dir)
+    manifest.close()
+    journal.close()
+    if negative_cache:
+        negative_cache.save()
     
     print(f"\nProcess completed. CDN links saved to {txt_path}")
     print(f"Successfully processed {len(successful_actors)} out of {len(actors)} actors.")
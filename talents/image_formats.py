@@ -0,0 +1,172 @@
+import os
+import argparse
+from PIL import Image
+
+# Leading bytes of each format; (offset, magic) pairs must all match
+SIGNATURES = {
+    'PNG': [(0, b'\x89PNG\r\n\x1a\n')],
+    'JPEG': [(0, b'\xff\xd8\xff')],
+    'GIF': [(0, b'GIF8')],
+    'WEBP': [(0, b'RIFF'), (8, b'WEBP')],
+    'AVIF': [(4, b'ftypavi')],
+    'BMP': [(0, b'BM')],
+}
+HEADER_SIZE = 16
+
+# File extension each format should be served under
+EXTENSIONS = {
+    'PNG': '.png',
+    'JPEG': '.jpg',
+    'GIF': '.gif',
+    'WEBP': '.webp',
+    'AVIF': '.avif',
+    'BMP': '.bmp',
+}
+
+# Content type each format is served with
+MIME_TYPES = {
+    'PNG': 'image/png',
+    'JPEG': 'image/jpeg',
+    'GIF': 'image/gif',
+    'WEBP': 'image/webp',
+    'AVIF': 'image/avif',
+    'BMP': 'image/bmp',
+}
+
+class FormatMismatch(ValueError):
+    """Raised when a file's content does not match its extension."""
+
+def sniff_format(data):
+    """
+    Identify an image format from its leading bytes. Accepts bytes or a
+    path, of which only the header is read. Returns None for unknown data.
+    """
+    if not isinstance(data, bytes):
+        with open(data, 'rb') as f:
+            data = f.read(HEADER_SIZE)
+    for name, parts in SIGNATURES.items():
+        if all(data[offset:offset + len(magic)] == magic for offset, magic in parts):
+            return name
+    return None
+
+def expected_format(path):
+    """Format implied by the file extension, or None for unknown extensions."""
+    ext = os.path.splitext(path)[1].lower()
+    if ext == '.jpeg':
+        return 'JPEG'
+    for name, known in EXTENSIONS.items():
+        if known == ext:
+            return name
+    return None
+
+def check_format(path, expected=None):
+    """
+    Raise FormatMismatch unless the content of path matches its extension,
+    or the expected format when one is given (e.g. for temporary files).
+    """
+    actual = sniff_format(path)
+    expected = expected or expected_format(path)
+    if expected and actual != expected:
+        raise FormatMismatch(f"{os.path.basename(path)} holds {actual or 'unknown'} data, not {expected}")
+
+def scan_formats(root):
+    """
+    Check the header of every file in the tree below root against its
+    extension. Returns a list of (path, expected format, actual format) mismatches.
+    """
+    mismatches = []
+    for directory, subdirs, names in os.walk(root):
+        subdirs.sort()
+        for name in sorted(names):
+            expected = expected_format(name)
+            if expected is None or name.startswith('.'):
+                continue
+            path = os.path.join(directory, name)
+            actual = sniff_format(path)
+            if actual != expected:
+                mismatches.append((path, expected, actual))
+    return mismatches
+
+def reencode(path, expected):
+    """Decode the file and write it back in the format its extension promises."""
+    with Image.open(path) as img:
+        img.load()
+    if expected in ('JPEG', 'BMP') and img.mode not in ('RGB', 'L'):
+        img = img.convert('RGB')
+    directory, name = os.path.split(path)
+    tmp_path = os.path.join(directory, f".{name}.reencode-{os.getpid()}.tmp")
+    try:
+        img.save(tmp_path, expected)
+        if sniff_format(tmp_path) != expected:
+            raise FormatMismatch(f"re-encoding {os.path.basename(path)} did not produce {expected} data")
+        os.replace(tmp_path, path)
+    except Exception:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+
+def write_typed_variant(path, actual):
+    """Copy the file unchanged next to itself under the extension of its real format."""
+    # Imported here, the downloader itself imports this module
+    from download_actors import atomic_write
+
+    variant = os.path.splitext(path)[0] + EXTENSIONS[actual]
+    with atomic_write(variant, fsync=True) as tmp_path:
+        with open(path, 'rb') as src, open(tmp_path, 'wb') as dst:
+            dst.write(src.read())
+    return variant
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Find actor images whose content does not match their extension.")
+    parser.add_argument("--images-dir", default="actors_images",
+                        help="Directory holding the actor images (default: actors_images)")
+    parser.add_argument("--fix", choices=["reencode", "variant"],
+                        help="reencode: rewrite mismatched files in the format of their extension "
+                             "(lossless, so photos grow several times over); "
+                             "variant: write an unchanged copy under the extension of the real format "
+                             "and link to it from the generated link files")
+    parser.add_argument("--state-dir", default=None,
+                        help="Downloader state directory whose asset manifest records the fixes "
+                             "(default: the downloader's)")
+    return parser.parse_args(argv)
+
+def main(argv=None):
+    args = parse_args(argv)
+    # Imported here, the downloader itself imports this module
+    from download_actors import DEFAULT_STATE_DIR, AssetManifest, file_digest
+
+    manifest_path = os.path.join(args.state_dir or DEFAULT_STATE_DIR, "assets.sqlite")
+    manifest = None
+    if args.fix and os.path.exists(manifest_path):
+        manifest = AssetManifest(manifest_path)
+
+    mismatches = scan_formats(args.images_dir)
+    for path, expected, actual in mismatches:
+        name = os.path.basename(path)
+        print(f"{name}: holds {actual or 'unknown'} data, extension says {expected}")
+        if not args.fix:
+            continue
+        try:
+            if args.fix == "reencode":
+                reencode(path, expected)
+                print(f"  re-encoded as {expected}")
+                if manifest:
+                    manifest.record_image(os.path.splitext(name)[0], path, digest=file_digest(path))
+            elif actual:
+                print(f"  wrote {os.path.basename(write_typed_variant(path, actual))}")
+                if manifest and expected == 'PNG' and os.path.normpath(os.path.dirname(path)) == os.path.normpath(args.images_dir):
+                    # The link files point at the copy from now on
+                    manifest.record_extension(os.path.splitext(name)[0], EXTENSIONS[actual])
+            else:
+                print("  unknown format, no variant written")
+        except Exception as e:
+            print(f"  Error fixing {name}: {str(e)}")
+    if manifest:
+        manifest.close()
+
+    print(f"\nFound {len(mismatches)} mislabelled files in {args.images_dir}.")
+    if args.fix == "variant" and mismatches:
+        print("Run download_actors.py to regenerate the link files with the new extensions.")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,115 @@
+import os
+import argparse
+import filecmp
+import shutil
+
+from download_actors import (ACTORS, DEFAULT_STATE_DIR, SHARDS_DIR, VARIANTS_DIR, AssetManifest, atomic_write,
+                             clean_name_for_file, load_roster, write_link_files)
+
+def shard_dirs(root):
+    """Every shard working directory below root that holds an image directory."""
+    if not os.path.isdir(root):
+        return []
+    return [entry.path for entry in sorted(os.scandir(root), key=lambda entry: entry.name)
+            if entry.is_dir() and os.path.isdir(os.path.join(entry.path, "actors_images"))]
+
+def slug_files(images_dir, slug):
+    """
+    Paths, relative to images_dir, of every file stored for one actor: the
+    original and its modern encodings, and the same below every variant width.
+    """
+    directories = [""]
+    variants_root = os.path.join(images_dir, VARIANTS_DIR)
+    if os.path.isdir(variants_root):
+        directories += sorted(os.path.join(VARIANTS_DIR, entry.name) for entry in os.scandir(variants_root)
+                              if entry.is_dir())
+    files = []
+    for directory in directories:
+        for entry in os.scandir(os.path.join(images_dir, directory)):
+            if entry.is_file() and os.path.splitext(entry.name)[0] == slug:
+                files.append(os.path.join(directory, entry.name))
+    return sorted(files)
+
+def copy_images(src, dst, slugs):
+    """
+    Copy the files of the given actors from the image tree src to the same
+    places below dst. An actor whose original already exists in dst with
+    other content is left alone, so no stored image is ever overwritten.
+    Returns (copied slugs, number of files copied).
+    """
+    copied_slugs = []
+    copied = 0
+    for slug in sorted(slugs):
+        original = os.path.join(dst, f"{slug}.png")
+        if os.path.exists(original) and not filecmp.cmp(os.path.join(src, f"{slug}.png"), original, shallow=False):
+            print(f"  keeping the existing image for {slug}")
+            continue
+        for name in slug_files(src, slug):
+            target = os.path.join(dst, name)
+            if os.path.exists(target) and filecmp.cmp(os.path.join(src, name), target, shallow=False):
+                continue
+            os.makedirs(os.path.dirname(target), exist_ok=True)
+            with atomic_write(target, fsync=True) as tmp_path:
+                shutil.copy2(os.path.join(src, name), tmp_path)
+            copied += 1
+        copied_slugs.append(slug)
+    return copied_slugs, copied
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Combine the images, manifests and link files of sharded runs.")
+    parser.add_argument("--shards-dir", default=SHARDS_DIR,
+                        help=f"Directory holding the shard working directories (default: {SHARDS_DIR})")
+    parser.add_argument("--images-dir", default="actors_images",
+                        help="Directory the shard images are merged into (default: actors_images)")
+    parser.add_argument("--state-dir", default=DEFAULT_STATE_DIR,
+                        help=f"State directory whose asset manifest receives the shard manifests "
+                             f"(default: {DEFAULT_STATE_DIR})")
+    parser.add_argument("--roster", default=None,
+                        help="Roster file the shards were run with (default: the built-in list)")
+    return parser.parse_args(argv)
+
+def main(argv=None):
+    args = parse_args(argv)
+    actors = load_roster(args.roster) if args.roster else list(ACTORS)
+
+    shards = shard_dirs(args.shards_dir)
+    if not shards:
+        print(f"No shards found in {args.shards_dir}.")
+        return
+
+    manifest = AssetManifest(os.path.join(args.state_dir, "assets.sqlite"))
+    for shard in shards:
+        shard_manifest_path = os.path.join(shard, DEFAULT_STATE_DIR, "assets.sqlite")
+        if not os.path.exists(shard_manifest_path):
+            print(f"{shard}: no manifest, skipping")
+            continue
+        # Only images the shard itself stored are taken over
+        shard_manifest = AssetManifest(shard_manifest_path)
+        downloaded = shard_manifest.done_slugs()
+        shard_manifest.close()
+        shard_images = os.path.join(shard, "actors_images")
+        downloaded = {slug for slug in downloaded if os.path.exists(os.path.join(shard_images, f"{slug}.png"))}
+        slugs, copied = copy_images(shard_images, args.images_dir, downloaded)
+        merged = 0
+        try:
+            merged = manifest.merge(shard_manifest_path, slugs)
+        except Exception as e:
+            print(f"Error merging the manifest of {shard}: {str(e)}")
+        print(f"{shard}: copied {copied} files, merged {merged} manifest entries")
+
+    # Images that were in the tree before the shards ran are indexed as well
+    manifest.sync_directory(args.images_dir)
+
+    # The link files are rebuilt for the whole roster from the merged manifest
+    done_slugs = manifest.done_slugs()
+    successful_actors = {actor for actor in actors if clean_name_for_file(actor) in done_slugs}
+    has_formats = any(fmt != 'PNG' for sources in manifest.picture_sources().values() for fmt in sources)
+    txt_path = write_link_files(actors, successful_actors, manifest,
+                                variants=bool(manifest.all_variants()), formats=has_formats)
+    manifest.close()
+
+    print(f"\nMerged {len(shards)} shards. CDN links saved to {txt_path}")
+    print(f"{len(successful_actors)} out of {len(actors)} actors have an image.")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,161 @@
+import os
+import argparse
+import struct
+import zlib
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from io import BytesIO
+from PIL import Image, PngImagePlugin
+
+from download_actors import DEFAULT_STATE_DIR, AssetManifest, atomic_write, file_digest
+from image_formats import sniff_format
+
+# zlib strategies tried for every image; Pillow picks the PNG row filters itself,
+# so the strategy is the knob that decides how well the filtered rows compress
+ZLIB_STRATEGIES = [
+    ("default", zlib.Z_DEFAULT_STRATEGY),
+    ("filtered", zlib.Z_FILTERED),
+    ("rle", zlib.Z_RLE),
+]
+
+def png_candidates(img):
+    """
+    Images that decode to exactly the same pixels as img, in the modes worth
+    trying. An RGBA image whose alpha channel is fully opaque is also tried as RGB.
+    """
+    candidates = [img]
+    if img.mode == 'RGBA' and img.getchannel('A').getextrema() == (255, 255):
+        candidates.append(img.convert('RGB'))
+    return candidates
+
+def encode_png(img, info, **options):
+    """
+    Encode img as PNG in memory, keeping its text chunks, its colour
+    information (ICC profile, gAMA, cHRM and sRGB), its pixel density and
+    its EXIF data. Pillow reads the chunk values scaled by 1/100000, so
+    they are written back exactly.
+    """
+    pnginfo = PngImagePlugin.PngInfo()
+    for key, value in info.get('text', {}).items():
+        pnginfo.add_text(key, value)
+    if 'gamma' in info:
+        pnginfo.add(b'gAMA', struct.pack('>I', round(info['gamma'] * 100000)))
+    if 'chromaticity' in info:
+        pnginfo.add(b'cHRM', struct.pack('>8I', *(round(value * 100000) for value in info['chromaticity'])))
+    if 'srgb' in info:
+        pnginfo.add(b'sRGB', bytes([info['srgb']]))
+    buffer = BytesIO()
+    extra = {key: info[key] for key in ('icc_profile', 'dpi', 'exif') if info.get(key)}
+    img.save(buffer, 'PNG', pnginfo=pnginfo, **extra, **options)
+    return buffer.getvalue()
+
+def same_pixels(data, original):
+    """Check that the encoded PNG decodes to exactly the original pixels."""
+    with Image.open(BytesIO(data)) as decoded:
+        if decoded.mode != original.mode:
+            decoded = decoded.convert(original.mode)
+        return decoded.size == original.size and decoded.tobytes() == original.tobytes()
+
+def recompress_image(path, dry_run=False):
+    """
+    Try every mode, zlib strategy and optimize=True on one PNG and keep the
+    smallest result that is bit-exact with the original pixels.
+    Returns (original bytes, new bytes, winning setting); new bytes equal
+    the original when nothing smaller was found. Returns None for files
+    that do not hold PNG data, and raises ValueError for those whose pHYs
+    chunk Pillow cannot write back.
+    """
+    original_size = os.path.getsize(path)
+    with Image.open(path) as img:
+        if img.format != 'PNG':
+            return None
+        img.load()
+        info = dict(img.info, text=getattr(img, 'text', {}))
+    if 'aspect' in info:
+        # Pillow only writes pHYs in pixels per metre, from a dpi value
+        raise ValueError("its pixel aspect ratio (pHYs without a unit) would be lost")
+
+    best, best_setting = None, None
+    for candidate in png_candidates(img):
+        settings = [(f"{candidate.mode} optimize", {'optimize': True})]
+        settings += [(f"{candidate.mode} level 9 {name}", {'compress_level': 9, 'compress_type': strategy})
+                     for name, strategy in ZLIB_STRATEGIES]
+        for setting, options in settings:
+            data = encode_png(candidate, info, **options)
+            if (best is None or len(data) < len(best)) and same_pixels(data, img):
+                best, best_setting = data, setting
+
+    if best is None or len(best) >= original_size:
+        return original_size, original_size, None
+    if not dry_run:
+        # Replace the file atomically so a crash never leaves a truncated image behind
+        with atomic_write(path, fsync=True) as tmp_path:
+            with open(tmp_path, 'wb') as f:
+                f.write(best)
+    return original_size, len(best), best_setting
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Losslessly recompress the actor PNGs in place.")
+    parser.add_argument("--images-dir", default="actors_images",
+                        help="Directory holding the actor images (default: actors_images)")
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1,
+                        help="Images recompressed in parallel (default: number of CPUs)")
+    parser.add_argument("--dry-run", action="store_true",
+                        help="Report the savings without rewriting any file")
+    parser.add_argument("--state-dir", default=DEFAULT_STATE_DIR,
+                        help=f"Downloader state directory whose asset manifest is updated (default: {DEFAULT_STATE_DIR})")
+    args = parser.parse_args(argv)
+    if args.workers < 1:
+        parser.error("--workers must be at least 1")
+    return args
+
+def main(argv=None):
+    args = parse_args(argv)
+
+    paths = []
+    for entry in sorted(os.scandir(args.images_dir), key=lambda entry: entry.name):
+        if not entry.name.endswith('.png') or not entry.is_file():
+            continue
+        if entry.stat().st_nlink > 1:
+            # Rewriting would detach the file from its deduplicated blob
+            print(f"Skipping {entry.name}, it is linked into the blob store.")
+            continue
+        if sniff_format(entry.path) != 'PNG':
+            print(f"Skipping {entry.name}, it does not hold PNG data.")
+            continue
+        paths.append(entry.path)
+
+    manifest_path = os.path.join(args.state_dir, "assets.sqlite")
+    manifest = AssetManifest(manifest_path) if os.path.exists(manifest_path) and not args.dry_run else None
+
+    total_before = total_after = 0
+    with ProcessPoolExecutor(max_workers=args.workers) as pool:
+        futures = {pool.submit(recompress_image, path, args.dry_run): path for path in paths}
+        for future in as_completed(futures):
+            path = futures[future]
+            name = os.path.basename(path)
+            try:
+                result = future.result()
+            except Exception as e:
+                print(f"Error recompressing {name}: {str(e)}")
+                continue
+            if result is None:
+                print(f"Skipping {name}, it does not hold PNG data.")
+                continue
+            before, after, setting = result
+            total_before += before
+            total_after += after
+            if setting is None:
+                print(f"{name}: {before} bytes, already as small as it gets")
+                continue
+            print(f"{name}: {before} -> {after} bytes ({100 * (before - after) / before:.1f}% smaller, {setting})")
+            if manifest:
+                manifest.record_image(name[:-len('.png')], path, digest=file_digest(path))
+    if manifest:
+        manifest.close()
+
+    saved = total_before - total_after
+    verb = "Would save" if args.dry_run else "Saved"
+    print(f"\n{verb} {saved} bytes over {len(paths)} images ({total_before} -> {total_after} bytes).")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,150 @@
+import os
+import argparse
+import struct
+from io import BytesIO
+from PIL import ExifTags, Image
+
+from download_actors import DEFAULT_STATE_DIR, AssetManifest, atomic_write, file_digest
+from image_formats import sniff_format
+from verify_images import PNG_SIGNATURE, image_files
+
+# PNG chunks that carry nothing needed to display the image
+PNG_METADATA_CHUNKS = {b'tEXt', b'zTXt', b'iTXt', b'eXIf', b'tIME'}
+
+# JPEG markers without a length field
+JPEG_STANDALONE_MARKERS = {0x01, 0xD8} | set(range(0xD0, 0xD8))
+JPEG_SOS = 0xDA
+
+def keep_jpeg_segment(marker, payload):
+    """
+    APPn and COM segments are metadata, except JFIF (APP0), ICC profiles
+    (APP2) and the Adobe segment (APP14), which tells decoders the colour transform.
+    """
+    if marker == 0xFE:
+        return False
+    if not 0xE0 <= marker <= 0xEF:
+        return True
+    return (marker == 0xE0 or marker == 0xEE
+            or (marker == 0xE2 and payload.startswith(b'ICC_PROFILE\0')))
+
+def strip_png(data):
+    """Copy the PNG chunk by chunk, leaving out text, EXIF and timestamp chunks."""
+    out = [PNG_SIGNATURE]
+    offset = len(PNG_SIGNATURE)
+    while offset + 12 <= len(data):
+        length, = struct.unpack_from('>I', data, offset)
+        end = offset + 12 + length
+        if data[offset + 4:offset + 8] not in PNG_METADATA_CHUNKS:
+            out.append(data[offset:end])
+        if data[offset + 4:offset + 8] == b'IEND':
+            break
+        offset = end
+    return b''.join(out)
+
+def strip_jpeg(data):
+    """
+    Copy the JPEG segment by segment, leaving out metadata segments. The
+    entropy-coded data from the start of scan onwards is copied unchanged,
+    so the pixels stay exactly the same.
+    """
+    out = [data[:2]]
+    offset = 2
+    while offset + 4 <= len(data):
+        if data[offset] != 0xFF:
+            raise ValueError(f"no JPEG marker at byte {offset}")
+        marker = data[offset + 1]
+        if marker == 0xFF:
+            # Fill byte before a marker
+            offset += 1
+            continue
+        if marker in JPEG_STANDALONE_MARKERS:
+            out.append(data[offset:offset + 2])
+            offset += 2
+            continue
+        if marker == JPEG_SOS:
+            out.append(data[offset:])
+            break
+        length, = struct.unpack_from('>H', data, offset + 2)
+        end = offset + 2 + length
+        if keep_jpeg_segment(marker, data[offset + 4:end]):
+            out.append(data[offset:end])
+        offset = end
+    return b''.join(out)
+
+def same_pixels(data, original):
+    with Image.open(BytesIO(data)) as stripped, Image.open(BytesIO(original)) as img:
+        return stripped.size == img.size and stripped.tobytes() == img.tobytes()
+
+def strip_file(path, dry_run=False):
+    """
+    Remove the metadata of one stored PNG or JPEG without re-encoding it.
+    Returns (original bytes, new bytes), or None for other formats. Raises
+    ValueError for images whose EXIF orientation would be lost.
+    """
+    fmt = sniff_format(path)
+    if fmt not in ('PNG', 'JPEG'):
+        return None
+    with Image.open(path) as img:
+        if img.getexif().get(ExifTags.Base.Orientation, 1) != 1:
+            raise ValueError("its EXIF orientation is not applied to the pixels")
+    with open(path, 'rb') as f:
+        data = f.read()
+    stripped = strip_png(data) if fmt == 'PNG' else strip_jpeg(data)
+    if len(stripped) >= len(data):
+        return len(data), len(data)
+    if not same_pixels(stripped, data):
+        raise ValueError("stripping changed the pixels")
+    if not dry_run:
+        with atomic_write(path, fsync=True) as tmp_path:
+            with open(tmp_path, 'wb') as f:
+                f.write(stripped)
+    return len(data), len(stripped)
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Strip EXIF, XMP, text and other metadata from the stored "
+                                                 "actor images without re-encoding them.")
+    parser.add_argument("--images-dir", default="actors_images",
+                        help="Directory tree holding the actor images (default: actors_images)")
+    parser.add_argument("--dry-run", action="store_true",
+                        help="Report the savings without rewriting any file")
+    parser.add_argument("--state-dir", default=DEFAULT_STATE_DIR,
+                        help=f"Downloader state directory whose asset manifest is updated (default: {DEFAULT_STATE_DIR})")
+    return parser.parse_args(argv)
+
+def main(argv=None):
+    args = parse_args(argv)
+
+    manifest_path = os.path.join(args.state_dir, "assets.sqlite")
+    manifest = AssetManifest(manifest_path) if os.path.exists(manifest_path) and not args.dry_run else None
+
+    total_before = total_after = stripped = 0
+    for path in image_files(args.images_dir):
+        name = os.path.basename(path)
+        if os.stat(path).st_nlink > 1:
+            # Rewriting would detach the file from its deduplicated blob
+            continue
+        try:
+            result = strip_file(path, args.dry_run)
+        except Exception as e:
+            print(f"Skipping {name}: {str(e)}")
+            continue
+        if result is None:
+            continue
+        before, after = result
+        total_before += before
+        total_after += after
+        if after < before:
+            stripped += 1
+            print(f"{name}: {before} -> {after} bytes ({before - after} bytes of metadata)")
+            slug, ext = os.path.splitext(name)
+            top_level = os.path.normpath(os.path.dirname(path)) == os.path.normpath(args.images_dir)
+            if manifest and ext == '.png' and top_level:
+                manifest.record_image(slug, path, digest=file_digest(path))
+    if manifest:
+        manifest.close()
+
+    verb = "Would remove" if args.dry_run else "Removed"
+    print(f"\n{verb} {total_before - total_after} bytes of metadata from {stripped} images.")
+
+if __name__ == "__main__":
+    main()
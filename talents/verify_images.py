@@ -0,0 +1,161 @@
+import os
+import argparse
+import json
+import mmap
+import struct
+import sys
+import time
+import zlib
+from concurrent.futures import ThreadPoolExecutor
+from PIL import Image
+
+from download_actors import DEFAULT_STATE_DIR, write_json_atomic
+from image_formats import FormatMismatch, check_format, expected_format, sniff_format
+
+PNG_SIGNATURE = b'\x89PNG\r\n\x1a\n'
+
+class CorruptImage(Exception):
+    """Raised when an image file is damaged."""
+
+def check_png_chunks(path):
+    """
+    Walk the chunks of a PNG through mmap and validate each CRC without
+    decompressing anything. The file must start with IHDR, end with IEND and
+    contain at least one IDAT chunk.
+    """
+    with open(path, 'rb') as f:
+        if os.fstat(f.fileno()).st_size < len(PNG_SIGNATURE) + 12:
+            raise CorruptImage("file too short for a PNG")
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mapped, memoryview(mapped) as data:
+            # CRCs are computed on memoryview slices, so chunks are never copied
+            offset = len(PNG_SIGNATURE)
+            seen_idat = False
+            first = True
+            while True:
+                if offset + 12 > len(data):
+                    raise CorruptImage(f"truncated at byte {offset}")
+                length, = struct.unpack_from('>I', data, offset)
+                chunk_type = bytes(data[offset + 4:offset + 8])
+                end = offset + 8 + length
+                if end + 4 > len(data):
+                    raise CorruptImage(f"{chunk_type.decode('latin-1')} chunk truncated at byte {offset}")
+                crc, = struct.unpack_from('>I', data, end)
+                if zlib.crc32(data[offset + 4:end]) != crc:
+                    raise CorruptImage(f"bad CRC in {chunk_type.decode('latin-1')} chunk at byte {offset}")
+                if first and chunk_type != b'IHDR':
+                    raise CorruptImage("first chunk is not IHDR")
+                first = False
+                seen_idat = seen_idat or chunk_type == b'IDAT'
+                offset = end + 4
+                if chunk_type == b'IEND':
+                    break
+            if not seen_idat:
+                raise CorruptImage("no image data")
+
+def check_decode(path):
+    """Fully decode the image."""
+    try:
+        with Image.open(path) as img:
+            img.load()
+    except Exception as e:
+        raise CorruptImage(f"cannot be decoded: {str(e)}")
+
+def verify_file(path, full=False):
+    """
+    Verify one image. PNGs get the chunk CRC walk, other formats (and every
+    file with full=True) a full decode. Returns (status, detail) where status
+    is 'ok', 'mislabelled' (intact but not in the format of its extension)
+    or 'corrupt'.
+    """
+    try:
+        actual = sniff_format(path)
+        if actual is None:
+            raise CorruptImage("unknown image format")
+        if actual == 'PNG':
+            check_png_chunks(path)
+        if full or actual != 'PNG':
+            check_decode(path)
+        check_format(path)
+    except FormatMismatch as e:
+        return 'mislabelled', str(e)
+    except CorruptImage as e:
+        return 'corrupt', str(e)
+    except OSError as e:
+        return 'corrupt', f"cannot be read: {str(e)}"
+    return 'ok', None
+
+def stat_key(stat):
+    """Cache key of a file: any rewrite changes its size, mtime or inode."""
+    return [stat.st_size, stat.st_mtime_ns, stat.st_ino]
+
+def load_cache(path):
+    try:
+        with open(path) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+def image_files(root):
+    """Paths of every file under root whose extension names an image format."""
+    for directory, _, names in os.walk(root):
+        for name in sorted(names):
+            if not name.startswith('.') and expected_format(name):
+                yield os.path.join(directory, name)
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Check that every stored actor image is intact.")
+    parser.add_argument("--images-dir", default="actors_images",
+                        help="Directory tree holding the actor images (default: actors_images)")
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1,
+                        help="Files verified in parallel (default: number of CPUs)")
+    parser.add_argument("--full", action="store_true",
+                        help="Fully decode every image instead of trusting valid PNG chunk CRCs")
+    parser.add_argument("--no-cache", action="store_true",
+                        help="Verify every file again, ignoring the results of earlier runs")
+    parser.add_argument("--state-dir", default=DEFAULT_STATE_DIR,
+                        help=f"Directory holding the verification cache (default: {DEFAULT_STATE_DIR})")
+    args = parser.parse_args(argv)
+    if args.workers < 1:
+        parser.error("--workers must be at least 1")
+    return args
+
+def main(argv=None):
+    args = parse_args(argv)
+    started = time.monotonic()
+
+    # Results are cached per file and mode, keyed by (size, mtime, inode)
+    cache_path = os.path.join(args.state_dir, "verify_cache.json")
+    mode = "full" if args.full else "fast"
+    cache = {} if args.no_cache else load_cache(cache_path)
+    results = {}
+    pending = []
+    for path in image_files(args.images_dir):
+        key = stat_key(os.stat(path))
+        entry = cache.get(path)
+        if entry and entry['key'] == key and entry['mode'] in (mode, "full"):
+            results[path] = entry
+        else:
+            pending.append((path, key))
+    cached = len(results)
+
+    with ThreadPoolExecutor(max_workers=args.workers) as pool:
+        outcomes = pool.map(lambda item: verify_file(item[0], args.full), pending)
+        for (path, key), (status, detail) in zip(pending, outcomes):
+            results[path] = {'key': key, 'mode': mode, 'status': status, 'detail': detail}
+
+    problems = 0
+    for path, entry in sorted(results.items()):
+        if entry['status'] != 'ok':
+            problems += 1
+            print(f"{path}: {entry['status']}, {entry['detail']}")
+
+    os.makedirs(args.state_dir, exist_ok=True)
+    write_json_atomic(cache_path, results)
+    elapsed = time.monotonic() - started
+    print(f"Verified {len(results)} images ({cached} unchanged since the last run) "
+          f"in {elapsed:.2f}s: {problems} problems.")
+    if problems:
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()